@@ -1,58 +1,828 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, CursorType, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
 import os
+import asyncio
+import fcntl
+import threading
+from contextlib import asynccontextmanager
 print("MONGO_URL =", os.environ.get('MONGO_URL'))
 import logging
 import json
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union, Iterable, Set, Callable, NamedTuple, Tuple
 import uuid
-from datetime import datetime
+import time
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 from enum import Enum
+from collections import deque
+from contextvars import ContextVar
+import bisect
+import numpy as np
+import pandas as pd
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - the msgpack wire format is then unavailable
+    msgpack = None
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# Exposed at /metrics in Prometheus text format. Each worker process keeps its
+# own registry, so scrape every worker (or sum across them).
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    ["method", "route", "status"], buckets=FAST_BUCKETS,
+)
+HTTP_REQUEST_MONGO_COMMANDS = Histogram(
+    "http_request_mongo_commands", "MongoDB round trips per HTTP request",
+    ["method", "route"], buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by the route that issued it",
+    ["route", "command", "collection"], buckets=FAST_BUCKETS,
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands by the route that issued them",
+    ["route", "command", "collection"],
+)
+WS_CONNECTIONS = Gauge("websocket_connections", "Open WebSocket connections")
+WS_FANOUT_SECONDS = Histogram(
+    "websocket_broadcast_fanout_seconds", "Time to enqueue one event for every recipient",
+    buckets=(.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005, .01),
+)
+WS_FANOUT_RECIPIENTS = Histogram(
+    "websocket_broadcast_recipients", "Recipients per broadcast event",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+WS_SEND_DELAY_SECONDS = Histogram(
+    "websocket_event_send_delay_seconds", "Time from event creation to the socket write",
+    buckets=FAST_BUCKETS,
+)
+
+BACKGROUND_ROUTE = "background"
+
+class RequestMetrics:
+    """Mongo commands issued while serving one HTTP request."""
+    __slots__ = ("commands",)
+
+    def __init__(self):
+        self.commands: List[Tuple[str, str, float, bool]] = []
+
+current_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request_metrics", default=None)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Times every command Motor sends. Motor runs pymongo on executor threads
+    with a copy of the caller's context, so current_request_metrics still
+    points at the request that issued the command.
+    """
+
+    def __init__(self):
+        self._targets: Dict[Tuple[int, Any], str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        self._targets[(event.request_id, event.connection_id)] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        self._finished(event, ok=True)
+
+    def failed(self, event):
+        self._finished(event, ok=False)
+
+    def _finished(self, event, ok: bool):
+        collection = self._targets.pop((event.request_id, event.connection_id), "")
+        seconds = event.duration_micros / 1_000_000
+        request = current_request_metrics.get()
+        if request is not None:
+            request.commands.append((event.command_name, collection, seconds, ok))
+        else:
+            observe_mongo_command(BACKGROUND_ROUTE, event.command_name, collection, seconds, ok)
+
+def observe_mongo_command(route: str, command: str, collection: str, seconds: float, ok: bool):
+    MONGO_COMMAND_SECONDS.labels(route, command, collection).observe(seconds)
+    if not ok:
+        MONGO_COMMAND_FAILURES.labels(route, command, collection).inc()
+
+MONGO_POOL_CONNECTIONS = Gauge("mongo_pool_connections", "MongoDB pool connections", ["state"])
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total", "Failed MongoDB connection checkouts", ["reason"]
+)
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts pool events; pymongo calls it from the executor threads Motor uses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+        MONGO_POOL_CONNECTIONS.labels("open").set(self.open)
+        MONGO_POOL_CONNECTIONS.labels("checked_out").set(self.checked_out)
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_checked_out(self, event):
+        self._add(checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+        MONGO_POOL_CHECKOUT_FAILURES.labels(event.reason).inc()
+
+    def pool_cleared(self, event):
+        self._add(cleared=1)
+
+    # The remaining events carry nothing the counters need
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "idle": self.open - self.checked_out,
+                "created": self.created,
+                "closed": self.closed,
+                "checkout_failures": self.checkout_failures,
+                "cleared": self.cleared,
+            }
+
 # MongoDB connection
+# The client is built here but connects lazily; the lifespan warms the pool
+# before the app takes traffic and closes it on shutdown.
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+MONGO_MAX_CONNECTING = int(os.environ.get('MONGO_MAX_CONNECTING', '4'))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# Bounds how long a request waits for a free connection (0 = wait forever)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+# Connections opened at startup, so the opening rush doesn't pay for handshakes
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get('MONGO_WARMUP_CONNECTIONS', str(MONGO_MIN_POOL_SIZE)))
+MONGO_READY_TIMEOUT_SECONDS = float(os.environ.get('MONGO_READY_TIMEOUT_SECONDS', '1.0'))
+
+def mongo_client_options() -> Dict[str, Any]:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxConnecting": MONGO_MAX_CONNECTING,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+pool_stats = PoolStats()
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url, event_listeners=[MongoCommandMetrics(), pool_stats], **mongo_client_options()
+)
 db = client[os.environ['DB_NAME']]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # startup() and shutdown() are defined with the rest of the lifecycle at the end
+    await startup(app)
+    try:
+        yield
+    finally:
+        await shutdown(app)
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Event encoding
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def encode_event(payload: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default)
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+# Compact wire formats
+# Opt-in per connection with /ws?encoding=compact|msgpack; those clients get
+# binary frames. Keys are shortened, timestamps become epoch milliseconds,
+# None values are dropped and order items shrink to [menu_item_id, quantity]
+# (plus special_requests when set), since clients already hold the menu.
+COMPACT_KEYS = {
+    "type": "t", "seq": "s", "stream": "sm", "resumed": "rs", "replayed": "rp",
+    "order": "o", "orders": "os", "order_id": "oi", "id": "i", "table_number": "n",
+    "waiter_name": "w", "status": "st", "items": "it", "total_amount": "a",
+    "created_at": "c", "updated_at": "u", "timestamp": "ts", "special_requests": "r",
+    "version": "v", "detail": "d", "topics": "tp", "encoding": "e",
+}
+COMPACT_TIME_KEYS = {"created_at", "updated_at", "timestamp"}
+WIRE_ENCODINGS = ("json", "compact", "msgpack")
+
+def _epoch_ms(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    return value
+
+def _compact_item(item: Dict[str, Any]) -> List[Any]:
+    compact = [item["menu_item_id"], item["quantity"]]
+    if item.get("special_requests"):
+        compact.append(item["special_requests"])
+    return compact
+
+def compact_value(key: Optional[str], value: Any) -> Any:
+    if key in COMPACT_TIME_KEYS:
+        return _epoch_ms(value)
+    if key == "items" and isinstance(value, list):
+        return [_compact_item(item) if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return compact_payload(value)
+    if isinstance(value, list):
+        return [compact_value(None, element) for element in value]
+    return value
+
+def compact_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        COMPACT_KEYS.get(key, key): compact_value(key, value)
+        for key, value in payload.items()
+        if value is not None
+    }
+
+def encode_compact(payload: Dict[str, Any], encoding: str) -> bytes:
+    compact = compact_payload(payload)
+    if encoding == "msgpack":
+        return msgpack.packb(compact, default=_json_default)
+    return encode_event(compact)
+
+class Event:
+    """A broadcast payload encoded once and shared by every subscriber."""
+    __slots__ = ("data", "topics", "created", "seq", "_text", "_encoded")
+
+    def __init__(self, payload: Dict[str, Any], topics: Iterable[str] = ()):
+        self.data = encode_event(payload)
+        self.topics = frozenset(topics)
+        self.created = time.perf_counter()
+        self.seq: Optional[int] = None
+        self._text: Optional[str] = None
+        self._encoded: Optional[Dict[str, bytes]] = None
+
+    @classmethod
+    def from_encoded(cls, data: bytes, topics: Iterable[str] = ()) -> "Event":
+        event = cls.__new__(cls)
+        event.data = data
+        event.topics = frozenset(topics)
+        event.created = time.perf_counter()
+        event.seq = None
+        event._text = None
+        event._encoded = None
+        return event
+
+    def with_seq(self, seq: int) -> "Event":
+        # Splices "seq" into the encoded object instead of encoding the payload again
+        separator = b"," if len(self.data) > 2 else b""
+        event = Event.from_encoded(b'{"seq":%d%s%s' % (seq, separator, self.data[1:]), self.topics)
+        event.created = self.created
+        event.seq = seq
+        return event
+
+    @property
+    def text(self) -> str:
+        # Text frames need a str; decode once and reuse it for every socket
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    def encoded(self, encoding: str) -> bytes:
+        """The event in a compact wire format, encoded on first use and shared like `data`."""
+        if self._encoded is None:
+            self._encoded = {}
+        if encoding not in self._encoded:
+            # Built from the canonical bytes, so it matches `data` exactly even if
+            # the source documents change later or the event came from the bus
+            payload = orjson.loads(self.data) if orjson is not None else json.loads(self.data)
+            self._encoded[encoding] = encode_compact(payload, encoding)
+        return self._encoded[encoding]
+
+class FastJSONResponse(Response):
+    """Serializes plain documents straight to bytes with encode_event()."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encode_event(content)
+
+# Subscription topics: "orders" is the kitchen feed, "table:<n>" and
+# "waiter:<name>" narrow it down, "*" receives every event
+ALL_TOPICS = "*"
+
+def order_topics(table_number: int, waiter_name: Optional[str]) -> List[str]:
+    topics = ["orders", f"table:{table_number}"]
+    if waiter_name:
+        topics.append(f"waiter:{waiter_name}")
+    return topics
+
+# Broadcast bus: carries events between workers so every process fans out
+# every event to its own sockets. "memory" is single-process, "mongo" shares
+# events through a capped collection that each worker tails.
+BROADCAST_BUS = os.environ.get('BROADCAST_BUS', 'memory')
+BROADCAST_BUS_COLLECTION = os.environ.get('BROADCAST_BUS_COLLECTION', 'broadcast_events')
+BROADCAST_BUS_SIZE_BYTES = int(os.environ.get('BROADCAST_BUS_SIZE_BYTES', str(16 * 1024 * 1024)))
+# Re-read window when a tail restarts, wide enough for clock skew between workers
+BROADCAST_BUS_GRACE = timedelta(seconds=float(os.environ.get('BROADCAST_BUS_GRACE_SECONDS', '5')))
+
+class InMemoryBus:
+    """Delivers events to every manager attached to the same bus in this process."""
+
+    def __init__(self):
+        self.managers: List["ConnectionManager"] = []
+
+    async def start(self, manager: "ConnectionManager"):
+        self.managers.append(manager)
+
+    async def stop(self, manager: "ConnectionManager"):
+        if manager in self.managers:
+            self.managers.remove(manager)
+
+    async def publish(self, event: Event, origin: "ConnectionManager"):
+        for manager in self.managers:
+            if manager is not origin:
+                manager.deliver(event)
+
+class MongoBus:
+    """Shares events between workers and pods through a tailable capped collection."""
+
+    def __init__(self, database, collection: str = BROADCAST_BUS_COLLECTION, size_bytes: int = BROADCAST_BUS_SIZE_BYTES):
+        self.database = database
+        self.collection_name = collection
+        self.size_bytes = size_bytes
+        self.worker_id = uuid.uuid4().hex
+        self.manager: Optional["ConnectionManager"] = None
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def collection(self):
+        return self.database[self.collection_name]
+
+    async def start(self, manager: "ConnectionManager"):
+        self.manager = manager
+        try:
+            await self.database.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # another worker created it first
+        self._tasks = [asyncio.create_task(self._publisher()), asyncio.create_task(self._tail())]
+
+    async def stop(self, manager: "ConnectionManager"):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def publish(self, event: Event, origin: "ConnectionManager"):
+        # Handlers never wait on the insert; the publisher task drains the outbox
+        self._outbox.put_nowait(event)
+
+    async def _publisher(self):
+        while True:
+            events = [await self._outbox.get()]
+            while not self._outbox.empty():
+                events.append(self._outbox.get_nowait())
+            docs = [{
+                "origin": self.worker_id,
+                "data": event.data,
+                "topics": list(event.topics),
+                "created_at": datetime.utcnow(),
+            } for event in events]
+            try:
+                await self.collection.insert_many(docs, ordered=True)
+            except Exception as e:
+                logger.error(f"Failed to publish {len(docs)} broadcast events: {e}")
+
+    async def _tail(self):
+        # ObjectIds from different workers in the same second sort by their
+        # random bytes, not by insertion, so a restarted cursor cannot resume
+        # after the last _id. It re-reads a created_at window instead, in
+        # $natural (insertion) order, and skips the events it already saw.
+        since = datetime.utcnow() - BROADCAST_BUS_GRACE
+        seen: Dict[Any, datetime] = {
+            doc["_id"]: doc["created_at"]
+            async for doc in self.collection.find({"created_at": {"$gte": since}}, {"_id": 1, "created_at": 1})
+        }
+        while True:
+            try:
+                cursor = self.collection.find({"created_at": {"$gte": since}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for doc in cursor:
+                    if doc["_id"] in seen:
+                        continue
+                    seen[doc["_id"]] = doc["created_at"]
+                    if doc["origin"] != self.worker_id and self.manager:
+                        self.manager.deliver(Event.from_encoded(doc["data"], doc.get("topics", ())))
+                    if len(seen) % 1000 == 0:
+                        since, seen = self._forget_seen(since, seen)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broadcast bus tail failed: {e}")
+            since, seen = self._forget_seen(since, seen)
+            # A tailable cursor dies on an empty collection; retry shortly
+            await asyncio.sleep(0.5)
+
+    @staticmethod
+    def _forget_seen(since: datetime, seen: Dict[Any, datetime]) -> Tuple[datetime, Dict[Any, datetime]]:
+        """Moves the restart window up to the newest event; ids below it can't come back."""
+        if seen:
+            since = max(since, max(seen.values()) - BROADCAST_BUS_GRACE)
+        return since, {doc_id: created_at for doc_id, created_at in seen.items() if created_at >= since}
+
+def create_broadcast_bus():
+    if BROADCAST_BUS == "memory":
+        return InMemoryBus()
+    if BROADCAST_BUS == "mongo":
+        return MongoBus(db)
+    raise ValueError(f"Unknown broadcast bus: {BROADCAST_BUS}")
+
+# WebSocket fan-out settings
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '256'))
+# "coalesce" drops the oldest queued frame for a slow client, "drop" disconnects it
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'coalesce')
+# Recent broadcast events kept for /ws?resume_from=<seq>
+WS_REPLAY_BUFFER_SIZE = int(os.environ.get('WS_REPLAY_BUFFER_SIZE', '1024'))
+# Heartbeats: the reaper pings every socket each interval and evicts ones that
+# sent nothing (pong or any other frame) within the idle timeout
+WS_PING_INTERVAL_SECONDS = float(os.environ.get('WS_PING_INTERVAL_SECONDS', '20'))
+WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get('WS_IDLE_TIMEOUT_SECONDS', '60'))
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', '1000'))
+# Off (0) by default: behind the ingress, or with every tablet on the
+# restaurant's one NAT'd Wi-Fi, all clients share a single address
+WS_MAX_CONNECTIONS_PER_IP = int(os.environ.get('WS_MAX_CONNECTIONS_PER_IP', '0'))
+
+# Close codes
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+WS_CLOSE_IDLE = 4408
+
+def client_ip(websocket: WebSocket) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the real client
+    return websocket.client.host if websocket.client else "unknown"
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.topics: Set[str] = set()
+        self.ip = client_ip(websocket)
+        self.encoding = "json"
+        self.last_seen = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+
 # WebSocket Connection Manager
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY, bus=None,
+                 replay_size: int = WS_REPLAY_BUFFER_SIZE, max_connections: int = WS_MAX_CONNECTIONS,
+                 max_per_ip: int = WS_MAX_CONNECTIONS_PER_IP, idle_timeout: float = WS_IDLE_TIMEOUT_SECONDS):
+        if policy not in ("coalesce", "drop"):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.bus = bus if bus is not None else InMemoryBus()
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        # topic -> connections, so a broadcast only visits interested sockets
+        self.subscriptions: Dict[str, Set[ClientConnection]] = {}
+        self.dropped_messages = 0
+        self.evicted_connections = 0
+        # Every delivered event gets the next seq of this stream. Seqs are per
+        # process, so a client that reconnects to another worker sees a
+        # different stream id and resyncs.
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.replay_buffer: deque = deque(maxlen=replay_size)
+        self.resumed_connections = 0
+        self.replayed_events = 0
+        self.resyncs = 0
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.connections_per_ip: Dict[str, int] = {}
+        self.rejected_connections = 0
+        self.reaped_connections = 0
+
+    def _admit(self, websocket: WebSocket) -> Optional[str]:
+        if len(self.active_connections) >= self.max_connections:
+            return "server connection limit reached"
+        if self.max_per_ip and self.connections_per_ip.get(client_ip(websocket), 0) >= self.max_per_ip:
+            return "per-client connection limit reached"
+        return None
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, resume_from: Optional[int] = None,
+                      stream: Optional[str] = None, topics: Optional[Iterable[str]] = None,
+                      encoding: str = "json") -> bool:
+        """Accepts the socket unless a connection cap is hit; returns whether it was accepted."""
+        refusal = self._admit(websocket)
+        if refusal is not None:
+            self.rejected_connections += 1
+            logger.warning(f"Refusing WebSocket from {client_ip(websocket)}: {refusal}")
+            await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+            return False
         await websocket.accept()
-        self.active_connections.append(websocket)
+        # No awaits from here on, so no broadcast can slip in between the
+        # replayed events and the live ones
+        connection = ClientConnection(websocket, self.queue_size)
+        connection.encoding = encoding
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.active_connections[websocket] = connection
+        self.connections_per_ip[connection.ip] = self.connections_per_ip.get(connection.ip, 0) + 1
+        WS_CONNECTIONS.inc()
+        # Clients get everything until they subscribe to something narrower
+        self.subscribe(websocket, topics or [ALL_TOPICS])
+        self._resume(connection, resume_from, stream)
+        return True
+
+    def touch(self, websocket: WebSocket):
+        connection = self.active_connections.get(websocket)
+        if connection:
+            connection.last_seen = time.monotonic()
+
+    def reap(self) -> int:
+        """Evicts connections idle past the timeout and pings the rest; returns the number evicted."""
+        now = time.monotonic()
+        ping = Event({"type": "ping", "timestamp": datetime.utcnow()})
+        idle = []
+        # A copy: under the drop policy a ping to a full queue disconnects
+        for connection in list(self.active_connections.values()):
+            if now - connection.last_seen > self.idle_timeout:
+                idle.append(connection)
+            else:
+                self._enqueue(connection, ping)
+        for connection in idle:
+            self.reaped_connections += 1
+            self.disconnect(connection.websocket)
+            asyncio.create_task(self._close(connection.websocket, WS_CLOSE_IDLE))
+        return len(idle)
+
+    async def reap_forever(self, interval: float = WS_PING_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                reaped = self.reap()
+                if reaped:
+                    logger.info(f"Reaped {reaped} idle WebSocket connections")
+            except Exception as e:
+                logger.error(f"WebSocket reaper failed: {e}")
+
+    def _wants(self, connection: ClientConnection, event: Event) -> bool:
+        return not event.topics or ALL_TOPICS in connection.topics or not connection.topics.isdisjoint(event.topics)
+
+    def replay_since(self, seq: int, connection: ClientConnection) -> Optional[List[Event]]:
+        """Buffered events after `seq` for this connection; None when some are no longer buffered."""
+        if seq > self.seq:
+            return None
+        if seq == self.seq:
+            return []
+        if not self.replay_buffer or seq < self.replay_buffer[0].seq - 1:
+            return None
+        start = seq - self.replay_buffer[0].seq + 1
+        return [event for event in list(self.replay_buffer)[start:] if self._wants(connection, event)]
+
+    def _resume(self, connection: ClientConnection, resume_from: Optional[int], stream: Optional[str]):
+        hello = {
+            "type": "hello", "stream": self.stream_id, "seq": self.seq, "resumed": False,
+            "encoding": connection.encoding,
+        }
+        if resume_from is None:
+            self._enqueue(connection, Event(hello))
+            return
+        missed = None
+        if stream in (None, self.stream_id):
+            missed = self.replay_since(resume_from, connection)
+        # A replay that would overflow the send queue is no better than a resync
+        if missed is None or len(missed) >= self.queue_size:
+            self.resyncs += 1
+            self._enqueue(connection, Event(hello))
+            self._enqueue(connection, Event({"type": "resync", "seq": self.seq}))
+            return
+        self.resumed_connections += 1
+        self.replayed_events += len(missed)
+        self._enqueue(connection, Event({**hello, "resumed": True, "replayed": len(missed)}))
+        for event in missed:
+            self._enqueue(connection, event)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        WS_CONNECTIONS.dec()
+        remaining = self.connections_per_ip.get(connection.ip, 1) - 1
+        if remaining > 0:
+            self.connections_per_ip[connection.ip] = remaining
+        else:
+            self.connections_per_ip.pop(connection.ip, None)
+        self._unsubscribe(connection, list(connection.topics))
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return []
+        topics = set(topics)
+        if ALL_TOPICS not in topics:
+            self._unsubscribe(connection, [ALL_TOPICS])
+        for topic in topics:
+            self.subscriptions.setdefault(topic, set()).add(connection)
+        connection.topics |= topics
+        return sorted(connection.topics)
+
+    def topics(self, websocket: WebSocket) -> Set[str]:
+        connection = self.active_connections.get(websocket)
+        return set(connection.topics) if connection else set()
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return []
+        self._unsubscribe(connection, topics)
+        return sorted(connection.topics)
+
+    def _unsubscribe(self, connection: ClientConnection, topics: Iterable[str]):
+        for topic in topics:
+            subscribers = self.subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.subscriptions[topic]
+            connection.topics.discard(topic)
+
+    async def _writer(self, connection: ClientConnection):
+        # One writer per socket: a slow client only ever blocks its own queue
+        try:
+            while True:
+                message = await connection.queue.get()
+                if isinstance(message, Event):
+                    WS_SEND_DELAY_SECONDS.observe(time.perf_counter() - message.created)
+                    if connection.encoding != "json":
+                        await connection.websocket.send_bytes(message.encoded(connection.encoding))
+                        connection.sent += 1
+                        continue
+                    message = message.text
+                await connection.websocket.send_text(message)
+                connection.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping WebSocket connection after send failure: {e}")
+            self.disconnect(connection.websocket)
+
+    def _enqueue(self, connection: ClientConnection, message: Union[Event, str]):
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            connection.dropped += 1
+            self.dropped_messages += 1
+
+        if self.policy == "coalesce":
+            # Keep the newest frames, the client refetches state on any event anyway
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+        else:
+            self.evicted_connections += 1
+            self.disconnect(connection.websocket)
+            asyncio.create_task(self._close(connection.websocket, WS_CLOSE_TRY_AGAIN_LATER))
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        connection = self.active_connections.get(websocket)
+        if connection:
+            self._enqueue(connection, message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                # Remove broken connections
-                self.active_connections.remove(connection)
+    def _recipients(self, message: Union[Event, str]) -> Set[ClientConnection]:
+        if not isinstance(message, Event) or not message.topics:
+            return set(self.active_connections.values())
+        recipients = set(self.subscriptions.get(ALL_TOPICS, ()))
+        for topic in message.topics:
+            recipients.update(self.subscriptions.get(topic, ()))
+        return recipients
+
+    def _sequence(self, event: Event) -> Event:
+        self.seq += 1
+        event = event.with_seq(self.seq)
+        self.replay_buffer.append(event)
+        return event
 
-manager = ConnectionManager()
+    def deliver(self, message: Union[Event, str]):
+        # Only enqueues; the per-connection writers do the actual network I/O
+        started = time.perf_counter()
+        if isinstance(message, Event):
+            message = self._sequence(message)
+        recipients = self._recipients(message)
+        for connection in recipients:
+            self._enqueue(connection, message)
+        WS_FANOUT_SECONDS.observe(time.perf_counter() - started)
+        WS_FANOUT_RECIPIENTS.observe(len(recipients))
+
+    async def broadcast(self, message: Union[Event, str]):
+        self.deliver(message)
+        if isinstance(message, Event):
+            await self.bus.publish(message, self)
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [c.queue.qsize() for c in self.active_connections.values()]
+        encodings: Dict[str, int] = {}
+        for connection in self.active_connections.values():
+            encodings[connection.encoding] = encodings.get(connection.encoding, 0) + 1
+        return {
+            "connections": len(depths),
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths, default=0),
+            "dropped_messages": self.dropped_messages,
+            "evicted_connections": self.evicted_connections,
+            "topics": {topic: len(subs) for topic, subs in self.subscriptions.items()},
+            "bus": type(self.bus).__name__,
+            "stream": self.stream_id,
+            "seq": self.seq,
+            "replay_buffered": len(self.replay_buffer),
+            "resumed_connections": self.resumed_connections,
+            "replayed_events": self.replayed_events,
+            "resyncs": self.resyncs,
+            "max_connections": self.max_connections,
+            "max_connections_per_ip": self.max_per_ip,
+            "client_ips": len(self.connections_per_ip),
+            "rejected_connections": self.rejected_connections,
+            "reaped_connections": self.reaped_connections,
+            "encodings": encodings,
+        }
+
+manager = ConnectionManager(bus=create_broadcast_bus())
 
 # Enums
 class OrderStatus(str, Enum):
@@ -91,6 +861,7 @@ class Table(BaseModel):
     status: TableStatus = TableStatus.AVAILABLE
     capacity: int
     current_customers: int = 0
+    occupied_since: Optional[datetime] = None
 
 class TableCreate(BaseModel):
     number: int
@@ -103,6 +874,14 @@ class OrderItem(BaseModel):
     price: float
     special_requests: Optional[str] = None
 
+class OrderItemCreate(BaseModel):
+    menu_item_id: str
+    quantity: int
+    special_requests: Optional[str] = None
+    # Ignored, the menu prices every order; still accepted from older clients
+    menu_item_name: Optional[str] = None
+    price: Optional[float] = None
+
 class Order(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     table_number: int
@@ -116,212 +895,2051 @@ class Order(BaseModel):
 
 class OrderCreate(BaseModel):
     table_number: int
-    items: List[OrderItem]
+    items: List[OrderItemCreate]
     waiter_name: str
     special_requests: Optional[str] = None
 
 class OrderStatusUpdate(BaseModel):
     status: OrderStatus
 
+ORDER_BATCH_MAX = 100
+
+class OrderBatchItem(OrderCreate):
+    # Generated on the device; a replayed batch returns the already stored order
+    idempotency_key: str = Field(..., min_length=1, max_length=128)
+
+class OrderBatch(BaseModel):
+    orders: List[OrderBatchItem] = Field(..., min_length=1, max_length=ORDER_BATCH_MAX)
+
+class OrderBatchRejection(BaseModel):
+    idempotency_key: str
+    errors: List[str]
+
+class OrderBatchResult(BaseModel):
+    orders: List[Order]
+    created: int
+    replayed: int
+    rejected: List[OrderBatchRejection] = []
+
+ACTIVE_ORDER_STATUSES = [OrderStatus.PENDING, OrderStatus.PREPARING, OrderStatus.READY]
+
+# Fast read path
+# Hot list endpoints fetch only the model's fields from Mongo and serialize
+# the documents directly, instead of building a model per document and then
+# having FastAPI validate and encode the list again. The routes keep
+# response_model so the OpenAPI schema is unchanged.
+def model_projection(model) -> Dict[str, int]:
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def with_model_defaults(model, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Older documents may predate a field; fill plain defaults like the model would
+    defaults = {
+        name: field.default for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+    for document in documents:
+        for name, value in defaults.items():
+            document.setdefault(name, value)
+    return documents
+
+# Delta sync
+# Every order/table write stamps a sync_seq from a hybrid clock (microseconds,
+# bumped to stay strictly increasing per worker). /api/sync re-reads a small
+# grace window behind the client's cursor so writes still in flight, or
+# stamped by a worker with a slightly lagging clock, are not missed.
+SYNC_GRACE_US = int(os.environ.get('SYNC_GRACE_MS', '2000')) * 1000
+# Cursors older than this get a full sync instead of a (possibly huge) delta
+SYNC_MAX_LAG_US = int(os.environ.get('SYNC_MAX_LAG_SECONDS', '600')) * 1_000_000
+SYNC_BATCH_LIMIT = 1000
+
+class SyncClock:
+    def __init__(self):
+        self.last = 0
+
+    def next(self) -> int:
+        self.last = max(time.time_ns() // 1000, self.last + 1)
+        return self.last
+
+sync_clock = SyncClock()
+
+def sync_stamp() -> Dict[str, Any]:
+    return {"updated_at": datetime.utcnow(), "sync_seq": sync_clock.next()}
+
+# Index bootstrap
+# Declared per collection and created idempotently at startup
+INDEXES = {
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # get_active_orders ($in on status, sorted by created_at) and the revenue pipeline
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        # Keyset pagination of the order history on (created_at, id)
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id_desc"),
+        IndexModel([("sync_seq", ASCENDING)], name="sync_seq"),
+        IndexModel(
+            [("idempotency_key", ASCENDING)], name="idempotency_key_unique", unique=True,
+            partialFilterExpression={"idempotency_key": {"$exists": True}}
+        ),
+    ],
+    "tables": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("number", ASCENDING)], name="number_unique", unique=True),
+        IndexModel([("sync_seq", ASCENDING)], name="sync_seq"),
+    ],
+    "order_events": [
+        IndexModel([("order_id", ASCENDING), ("version", ASCENDING)], name="order_version_unique", unique=True),
+        IndexModel([("ts", ASCENDING)], name="ts"),
+    ],
+    "order_snapshots": [
+        IndexModel([("ts", DESCENDING)], name="ts_desc"),
+    ],
+    "table_sessions": [
+        IndexModel([("ended_at", ASCENDING)], name="ended_at"),
+    ],
+    "revenue_rollups": [
+        IndexModel(
+            [("tz", ASCENDING), ("granularity", ASCENDING), ("start", ASCENDING)],
+            name="tz_granularity_start_unique", unique=True
+        ),
+    ],
+    "menu_items": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("available", ASCENDING), ("category", ASCENDING)], name="available_category"),
+    ],
+}
+
+# (collection, index name) pairs that could not be built at startup
+missing_indexes: Set[Tuple[str, str]] = set()
+
+async def ensure_indexes(database):
+    # One index per command: a failed build must not take the others down with it
+    missing_indexes.clear()
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await database[collection].create_indexes([index])
+            except OperationFailure as e:
+                # e.g. duplicate table numbers left over from the old racy create_table
+                missing_indexes.add((collection, index.document["name"]))
+                logger.error(f"Could not create index {index.document['name']} on {collection}: {e}")
+
+async def index_report(database) -> Dict[str, Any]:
+    report = {}
+    for collection in INDEXES:
+        declared = {index.document["name"] for index in INDEXES[collection]}
+        usage = await database[collection].aggregate([{"$indexStats": {}}]).to_list(100)
+        report[collection] = [{
+            "name": stat["name"],
+            "key": dict(stat["key"]),
+            "declared": stat["name"] in declared,
+            "ops": stat["accesses"]["ops"],
+            "since": stat["accesses"]["since"],
+        } for stat in usage]
+    return report
+
+# Dashboard stats engine
+# Seeded from the aggregation pipelines at startup, then kept current by the
+# write paths. Writes made by other workers are picked up by the periodic
+# reconcile.
+STATS_RECONCILE_SECONDS = float(os.environ.get('STATS_RECONCILE_SECONDS', '30'))
+
+def today_start_utc() -> datetime:
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+class DashboardStats:
+    def __init__(self):
+        self.order_counts: Dict[str, int] = {}
+        self.table_status: Dict[str, str] = {}  # table id -> status
+        self.table_ids: Dict[int, str] = {}  # table number -> table id
+        self.revenue_day: Optional[datetime] = None
+        self.today_revenue = 0.0
+        self.reconciled_at: Optional[datetime] = None
+
+    async def load(self, database):
+        pipeline = [
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}}
+        ]
+        order_stats = await database.orders.aggregate(pipeline).to_list(100)
+
+        tables = await database.tables.find({}, {"_id": 0, "id": 1, "number": 1, "status": 1}).to_list(1000)
+
+        today_start = today_start_utc()
+        revenue_pipeline = [
+            {"$match": {
+                "created_at": {"$gte": today_start},
+                "status": {"$in": [OrderStatus.DELIVERED]}
+            }},
+            {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
+        ]
+        revenue_result = await database.orders.aggregate(revenue_pipeline).to_list(1)
+
+        self.order_counts = {stat["_id"]: stat["count"] for stat in order_stats}
+        self.table_status = {table["id"]: table["status"] for table in tables}
+        self.table_ids = {table["number"]: table["id"] for table in tables}
+        self.revenue_day = today_start
+        self.today_revenue = revenue_result[0]["total"] if revenue_result else 0
+        self.reconciled_at = datetime.utcnow()
+
+    async def reconcile_forever(self, database, interval: float = STATS_RECONCILE_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load(database)
+            except Exception as e:
+                logger.error(f"Dashboard stats reconcile failed: {e}")
+
+    def _roll_day(self):
+        today_start = today_start_utc()
+        if self.revenue_day != today_start:
+            self.revenue_day = today_start
+            self.today_revenue = 0.0
+
+    def _count(self, status: str, delta: int):
+        count = self.order_counts.get(status, 0) + delta
+        if count > 0:
+            self.order_counts[status] = count
+        else:
+            self.order_counts.pop(status, None)
+
+    def order_created(self, order: Dict[str, Any]):
+        self._count(order["status"], 1)
+
+    def order_status_changed(self, before: Dict[str, Any], status: str):
+        """`before` is the order document as it was prior to the update."""
+        if before["status"] == status:
+            return
+        self._count(before["status"], -1)
+        self._count(status, 1)
+
+        self._roll_day()
+        if before["created_at"] >= self.revenue_day:
+            if status == OrderStatus.DELIVERED:
+                self.today_revenue += before["total_amount"]
+            elif before["status"] == OrderStatus.DELIVERED:
+                self.today_revenue -= before["total_amount"]
+
+    def table_added(self, table: Dict[str, Any]):
+        self.table_status[table["id"]] = table["status"]
+        self.table_ids[table["number"]] = table["id"]
+
+    def table_status_changed(self, status: str, table_id: Optional[str] = None, number: Optional[int] = None):
+        if table_id is None:
+            table_id = self.table_ids.get(number)
+        if table_id in self.table_status:
+            self.table_status[table_id] = status
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._roll_day()
+        tables: Dict[str, int] = {}
+        for status in self.table_status.values():
+            tables[status] = tables.get(status, 0) + 1
+        return {
+            "orders": dict(sorted(self.order_counts.items())),
+            "tables": dict(sorted(tables.items())),
+            "today_revenue": self.today_revenue,
+        }
+
+dashboard_stats = DashboardStats()
+
+# Revenue rollups
+# Pre-aggregated revenue, order counts and item quantities in hourly and daily
+# buckets for each configured timezone (first one is the default). Buckets
+# follow the order's created_at, like the dashboard revenue, and are
+# incremented once when an order reaches DELIVERED, which is terminal.
+ANALYTICS_TIMEZONES = [name.strip() for name in os.environ.get('ANALYTICS_TIMEZONES', 'UTC').split(',') if name.strip()]
+ANALYTICS_MAX_BUCKETS = int(os.environ.get('ANALYTICS_MAX_BUCKETS', '2000'))
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+def bucket_start(moment: datetime, zone: ZoneInfo, granularity: str) -> datetime:
+    """Start of the local hour/day containing `moment`, as a naive UTC datetime."""
+    local = moment.replace(tzinfo=timezone.utc).astimezone(zone)
+    if granularity == "hour":
+        local = local.replace(minute=0, second=0, microsecond=0)
+    else:
+        local = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+def local_label(start: datetime, zone: ZoneInfo) -> str:
+    return start.replace(tzinfo=timezone.utc).astimezone(zone).isoformat()
+
+class RevenueRollups:
+    def __init__(self, timezones: List[str] = ANALYTICS_TIMEZONES, collection: str = "revenue_rollups"):
+        self.zones = {name: ZoneInfo(name) for name in timezones}
+        self.default_tz = timezones[0]
+        self.collection_name = collection
+
+    def zone(self, tz: Optional[str]) -> Tuple[str, ZoneInfo]:
+        name = tz or self.default_tz
+        if name not in self.zones:
+            raise HTTPException(status_code=400, detail=f"Timezone not tracked: {name} (tracked: {', '.join(self.zones)})")
+        return name, self.zones[name]
+
+    def _increments(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        inc = {"revenue": order["total_amount"], "orders": 1}
+        for item in order["items"]:
+            key = f"items.{item['menu_item_id']}"
+            inc[f"{key}.quantity"] = inc.get(f"{key}.quantity", 0) + item["quantity"]
+            inc[f"{key}.revenue"] = inc.get(f"{key}.revenue", 0) + item["price"] * item["quantity"]
+        return inc
+
+    def _names(self, order: Dict[str, Any]) -> Dict[str, str]:
+        return {f"items.{item['menu_item_id']}.name": item["menu_item_name"] for item in order["items"]}
+
+    async def record(self, database, order: Dict[str, Any]):
+        inc, names = self._increments(order), self._names(order)
+        updates = [
+            UpdateOne(
+                {"tz": tz, "granularity": granularity, "start": bucket_start(order["created_at"], zone, granularity)},
+                {"$inc": inc, "$set": names},
+                upsert=True,
+            )
+            for tz, zone in self.zones.items()
+            for granularity in ROLLUP_GRANULARITIES
+        ]
+        try:
+            await database[self.collection_name].bulk_write(updates, ordered=False)
+        except Exception as e:
+            # The delivery itself already succeeded; a rebuild recovers the buckets
+            logger.error(f"Failed to roll up order {order['id']}: {e}")
+
+    async def rebuild(self, database) -> int:
+        """Recomputes every bucket from delivered orders. Run it off-peak."""
+        buckets: Dict[Tuple[str, str, datetime], Dict[str, Any]] = {}
+        delivered = 0
+        cursor = database.orders.find(
+            {"status": OrderStatus.DELIVERED},
+            {"_id": 0, "created_at": 1, "total_amount": 1, "items": 1}
+        )
+        async for order in cursor:
+            delivered += 1
+            for tz, zone in self.zones.items():
+                for granularity in ROLLUP_GRANULARITIES:
+                    start = bucket_start(order["created_at"], zone, granularity)
+                    bucket = buckets.setdefault((tz, granularity, start), {
+                        "tz": tz, "granularity": granularity, "start": start,
+                        "revenue": 0.0, "orders": 0, "items": {},
+                    })
+                    bucket["revenue"] += order["total_amount"]
+                    bucket["orders"] += 1
+                    for item in order["items"]:
+                        entry = bucket["items"].setdefault(
+                            item["menu_item_id"], {"name": item["menu_item_name"], "quantity": 0, "revenue": 0.0}
+                        )
+                        entry["quantity"] += item["quantity"]
+                        entry["revenue"] += item["price"] * item["quantity"]
+        collection = database[self.collection_name]
+        await collection.delete_many({})
+        if buckets:
+            await collection.insert_many(list(buckets.values()))
+        return delivered
+
+    def _range(self, zone: ZoneInfo, granularity: str, start: Optional[datetime], end: Optional[datetime]) -> List[datetime]:
+        """Bucket starts (naive UTC) covering [start, end], in local time when naive."""
+        def to_utc(moment: datetime) -> datetime:
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=zone)
+            return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+        end_utc = to_utc(end) if end else datetime.utcnow()
+        if start:
+            start_utc = to_utc(start)
+        else:
+            # Default window: this week, i.e. today and the six days before it
+            start_utc = bucket_start(end_utc, zone, "day") - timedelta(days=6)
+        first = bucket_start(start_utc, zone, granularity)
+        if end_utc < first:
+            raise HTTPException(status_code=400, detail="end is before start")
+
+        starts = []
+        current = first
+        while current <= end_utc:
+            if len(starts) >= ANALYTICS_MAX_BUCKETS:
+                raise HTTPException(status_code=400, detail=f"Range spans more than {ANALYTICS_MAX_BUCKETS} buckets")
+            starts.append(current)
+            if granularity == "hour":
+                current += timedelta(hours=1)
+            else:
+                # Step in local days so DST changes keep buckets on midnight
+                local = current.replace(tzinfo=timezone.utc).astimezone(zone).replace(tzinfo=None) + timedelta(days=1)
+                current = local.replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+        return starts
+
+    async def _buckets(self, database, tz: str, granularity: str, starts: List[datetime]) -> Dict[datetime, Dict[str, Any]]:
+        if not starts:
+            return {}
+        docs = await database[self.collection_name].find(
+            {"tz": tz, "granularity": granularity, "start": {"$gte": starts[0], "$lte": starts[-1]}},
+            {"_id": 0}
+        ).to_list(None)
+        return {doc["start"]: doc for doc in docs}
+
+    async def series(self, database, granularity: str, tz: Optional[str], start: Optional[datetime], end: Optional[datetime]) -> Dict[str, Any]:
+        tz, zone = self.zone(tz)
+        starts = self._range(zone, granularity, start, end)
+        found = await self._buckets(database, tz, granularity, starts)
+        buckets = []
+        for bucket in starts:
+            doc = found.get(bucket, {})
+            revenue, orders = doc.get("revenue", 0.0), doc.get("orders", 0)
+            buckets.append({
+                "start": local_label(bucket, zone),
+                "revenue": round(revenue, 2),
+                "orders": orders,
+                "average_ticket": round(revenue / orders, 2) if orders else 0.0,
+            })
+        return {
+            "tz": tz,
+            "granularity": granularity,
+            "revenue": round(sum(b["revenue"] for b in buckets), 2),
+            "orders": sum(b["orders"] for b in buckets),
+            "buckets": buckets,
+        }
+
+    async def top_items(self, database, tz: Optional[str], start: Optional[datetime], end: Optional[datetime], limit: int) -> Dict[str, Any]:
+        tz, zone = self.zone(tz)
+        starts = self._range(zone, "day", start, end)
+        found = await self._buckets(database, tz, "day", starts)
+        totals: Dict[str, Dict[str, Any]] = {}
+        for doc in found.values():
+            for item_id, item in doc.get("items", {}).items():
+                entry = totals.setdefault(item_id, {"menu_item_id": item_id, "name": item.get("name"), "quantity": 0, "revenue": 0.0})
+                entry["quantity"] += item.get("quantity", 0)
+                entry["revenue"] += item.get("revenue", 0.0)
+        items = sorted(totals.values(), key=lambda entry: (-entry["quantity"], -entry["revenue"]))[:limit]
+        for entry in items:
+            entry["revenue"] = round(entry["revenue"], 2)
+        return {
+            "tz": tz,
+            "start": local_label(starts[0], zone) if starts else None,
+            "items": items,
+        }
+
+revenue_rollups = RevenueRollups()
+
+# Columnar analytics
+# Orders and their line items are pulled from Mongo in batches straight into
+# DataFrames; every report is a vectorized groupby, never a loop over dicts.
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', '20000'))
+ANALYTICS_DEFAULT_DAYS = 30
+
+ORDER_COLUMNS = ["id", "table_number", "waiter_name", "status", "total_amount", "created_at", "updated_at"]
+LINE_COLUMNS = ["order_id", "status", "created_at", "menu_item_id", "menu_item_name", "quantity", "price"]
+SESSION_COLUMNS = ["table_number", "started_at", "ended_at", "minutes", "orders"]
+
+async def frame_from_cursor(cursor, columns: List[str]) -> pd.DataFrame:
+    chunks = []
+    while True:
+        batch = await cursor.to_list(ANALYTICS_BATCH_SIZE)
+        if not batch:
+            break
+        chunks.append(pd.DataFrame.from_records(batch, columns=columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+def _categorize(frame: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    # Low-cardinality strings as categories: a fraction of the memory, faster groupby
+    for column in columns:
+        frame[column] = frame[column].astype("category")
+    return frame
+
+def _created_between(since: datetime, until: datetime) -> Dict[str, Any]:
+    return {"created_at": {"$gte": since, "$lt": until}}
+
+async def load_orders_frame(database, since: datetime, until: datetime) -> pd.DataFrame:
+    orders = await frame_from_cursor(
+        database.orders.find(
+            _created_between(since, until), {"_id": 0, **{column: 1 for column in ORDER_COLUMNS}}
+        ).batch_size(ANALYTICS_BATCH_SIZE),
+        ORDER_COLUMNS,
+    )
+    orders["created_at"] = pd.to_datetime(orders["created_at"])
+    orders["updated_at"] = pd.to_datetime(orders["updated_at"])
+    orders["total_amount"] = orders["total_amount"].astype("float64")
+    return _categorize(orders, ["waiter_name", "status"])
+
+async def load_lines_frame(database, since: datetime, until: datetime) -> pd.DataFrame:
+    # $unwind on the server hands back flat line rows instead of nested items
+    lines = await frame_from_cursor(
+        database.orders.aggregate([
+            {"$match": _created_between(since, until)},
+            {"$unwind": "$items"},
+            {"$project": {
+                "_id": 0,
+                "order_id": "$id",
+                "status": 1,
+                "created_at": 1,
+                "menu_item_id": "$items.menu_item_id",
+                "menu_item_name": "$items.menu_item_name",
+                "quantity": "$items.quantity",
+                "price": "$items.price",
+            }},
+        ], batchSize=ANALYTICS_BATCH_SIZE),
+        LINE_COLUMNS,
+    )
+    lines["created_at"] = pd.to_datetime(lines["created_at"])
+    lines["quantity"] = lines["quantity"].astype("int64")
+    lines["price"] = lines["price"].astype("float64")
+    return _categorize(lines, ["status", "menu_item_id", "menu_item_name"])
+
+async def load_sessions_frame(database, since: datetime, until: datetime) -> pd.DataFrame:
+    """Table sessions (first order seated to last one closed) that ended in the window."""
+    sessions = await frame_from_cursor(
+        database.table_sessions.find(
+            {"ended_at": {"$gte": since, "$lt": until}}, {"_id": 0, **{column: 1 for column in SESSION_COLUMNS}}
+        ).batch_size(ANALYTICS_BATCH_SIZE),
+        SESSION_COLUMNS,
+    )
+    sessions["started_at"] = pd.to_datetime(sessions["started_at"])
+    sessions["ended_at"] = pd.to_datetime(sessions["ended_at"])
+    sessions["minutes"] = sessions["minutes"].astype("float64")
+    sessions["orders"] = sessions["orders"].astype("int64")
+    return sessions
+
+def _records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    return frame.round(2).replace({np.nan: None}).to_dict("records")
+
+def top_items_report(lines: pd.DataFrame, limit: int) -> List[Dict[str, Any]]:
+    sold = lines[lines["status"] != OrderStatus.CANCELLED.value]
+    sold = sold.assign(revenue=sold["quantity"].to_numpy() * sold["price"].to_numpy())
+    report = sold.groupby("menu_item_id", observed=True).agg(
+        name=("menu_item_name", "last"),
+        quantity=("quantity", "sum"),
+        revenue=("revenue", "sum"),
+        orders=("order_id", "nunique"),
+    )
+    report = report.nlargest(limit, ["quantity", "revenue"]).reset_index()
+    report["name"] = report["name"].astype(str)
+    return _records(report)
+
+def average_ticket_report(orders: pd.DataFrame) -> Dict[str, Any]:
+    totals = orders.loc[orders["status"] == OrderStatus.DELIVERED.value, "total_amount"].to_numpy()
+    if totals.size == 0:
+        return {"orders": 0, "revenue": 0.0, "mean": None, "median": None, "p90": None}
+    return {
+        "orders": int(totals.size),
+        "revenue": round(float(totals.sum()), 2),
+        "mean": round(float(totals.mean()), 2),
+        "median": round(float(np.median(totals)), 2),
+        "p90": round(float(np.percentile(totals, 90)), 2),
+    }
+
+def table_turnover_report(orders: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Minutes from created_at to the delivery (updated_at) of delivered orders, per table."""
+    delivered = orders[orders["status"] == OrderStatus.DELIVERED.value]
+    minutes = (delivered["updated_at"] - delivered["created_at"]).dt.total_seconds() / 60
+    report = minutes.groupby(delivered["table_number"]).agg(["count", "mean", "median", "max"])
+    report.columns = ["orders", "mean_minutes", "median_minutes", "max_minutes"]
+    return _records(report.reset_index())
+
+def table_sessions_report(sessions: pd.DataFrame, since: datetime, until: datetime) -> List[Dict[str, Any]]:
+    """Session count and length per table, and the share of the window each table was occupied."""
+    report = sessions.groupby("table_number").agg(
+        sessions=("minutes", "count"),
+        mean_minutes=("minutes", "mean"),
+        median_minutes=("minutes", "median"),
+        max_minutes=("minutes", "max"),
+        occupied_minutes=("minutes", "sum"),
+        orders_per_session=("orders", "mean"),
+    )
+    report["occupancy"] = report["occupied_minutes"] / ((until - since).total_seconds() / 60)
+    return _records(report.reset_index())
+
+def waiter_throughput_report(orders: pd.DataFrame) -> List[Dict[str, Any]]:
+    delivered = orders["status"] == OrderStatus.DELIVERED.value
+    frame = orders.assign(
+        delivered=delivered,
+        revenue=np.where(delivered, orders["total_amount"], 0.0),
+        minutes=np.where(delivered, (orders["updated_at"] - orders["created_at"]).dt.total_seconds() / 60, np.nan),
+    )
+    report = frame.groupby("waiter_name", observed=True).agg(
+        orders=("id", "count"),
+        delivered=("delivered", "sum"),
+        revenue=("revenue", "sum"),
+        mean_fulfillment_minutes=("minutes", "mean"),
+        first=("created_at", "min"),
+        last=("created_at", "max"),
+    )
+    # Orders per hour over the span the waiter was actually taking orders
+    hours = ((report["last"] - report["first"]).dt.total_seconds() / 3600).clip(lower=1.0)
+    report["orders_per_hour"] = report["orders"] / hours
+    report = report.drop(columns=["first", "last"]).sort_values("orders", ascending=False).reset_index()
+    report["waiter_name"] = report["waiter_name"].astype(str)
+    return _records(report)
+
+def analytics_report(orders: pd.DataFrame, lines: pd.DataFrame, limit: int) -> Dict[str, Any]:
+    return {
+        "orders": int(len(orders)),
+        "line_items": int(len(lines)),
+        "top_items": top_items_report(lines, limit),
+        "average_ticket": average_ticket_report(orders),
+        "table_turnover": table_turnover_report(orders),
+        "waiter_throughput": waiter_throughput_report(orders),
+    }
+
+def analytics_window(since: Optional[datetime], until: Optional[datetime]) -> Tuple[datetime, datetime]:
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    return since, until
+
+# Menu cache
+# Keeps the serialized menu responses. Local menu writes invalidate it at
+# once; the TTL bounds how long a write made on another worker stays unseen.
+MENU_CACHE_TTL_SECONDS = float(os.environ.get('MENU_CACHE_TTL_SECONDS', '60'))
+
+class CachedBody:
+    __slots__ = ("body", "etag", "version", "loaded_at")
+
+    def __init__(self, body: bytes, version: int):
+        self.body = body
+        self.version = version
+        # From the content alone, so every worker tags the same menu alike;
+        # the per-process version only goes out as X-Menu-Version
+        self.etag = f'"menu-{hashlib.sha1(body).hexdigest()[:16]}"'
+        self.loaded_at = time.monotonic()
+
+class MenuCache:
+    def __init__(self, ttl: float = MENU_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, CachedBody] = {}
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+
+    def _fresh(self, key: str) -> Optional[CachedBody]:
+        entry = self._entries.get(key)
+        if entry and entry.version == self.version and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+        return None
+
+    async def get(self, key: str, loader) -> CachedBody:
+        entry = self._fresh(key)
+        if entry:
+            self.hits += 1
+            return entry
+        async with self._lock:
+            # Another request may have reloaded it while we waited
+            entry = self._fresh(key)
+            if entry:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version = self.version
+            entry = CachedBody(encode_event(await loader()), version)
+            if version == self.version:
+                self._entries[key] = entry
+            return entry
+
+menu_cache = MenuCache()
+
+# Menu price index
+# menu_items by id, used to price orders server-side without a query per
+# line item. Local menu writes reload it; an unknown id or the TTL triggers a
+# reload so items added on other workers are picked up.
+MENU_INDEX_MISS_RELOAD_SECONDS = 1.0
+
+class MenuPriceEntry(NamedTuple):
+    name: str
+    price: float
+    available: bool
+
+class MenuPriceIndex:
+    def __init__(self, ttl: float = MENU_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.items: Dict[str, MenuPriceEntry] = {}
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def load(self, database):
+        docs = await database.menu_items.find({}, {"_id": 0, "id": 1, "name": 1, "price": 1, "available": 1}).to_list(None)
+        self.items = {
+            doc["id"]: MenuPriceEntry(doc["name"], doc["price"], doc.get("available", True))
+            for doc in docs
+        }
+        self.loaded_at = time.monotonic()
+
+    async def ensure_fresh(self, database, menu_item_ids: Iterable[str] = ()):
+        age = time.monotonic() - self.loaded_at
+        missing = any(item_id not in self.items for item_id in menu_item_ids)
+        if age < self.ttl and not (missing and age >= MENU_INDEX_MISS_RELOAD_SECONDS):
+            return
+        async with self._lock:
+            if self.loaded_at == 0.0 or time.monotonic() - self.loaded_at >= MENU_INDEX_MISS_RELOAD_SECONDS:
+                await self.load(database)
+
+    def price_items(self, items: List[OrderItemCreate]) -> List[OrderItem]:
+        """Replaces client-sent names and prices with the menu's; rejects unknown or unavailable items."""
+        priced, errors = [], []
+        for item in items:
+            entry = self.items.get(item.menu_item_id)
+            if entry is None:
+                errors.append(f"Unknown menu item: {item.menu_item_id}")
+            elif not entry.available:
+                errors.append(f"Menu item not available: {entry.name}")
+            elif item.quantity < 1:
+                errors.append(f"Invalid quantity for {entry.name}: {item.quantity}")
+            else:
+                priced.append(OrderItem(
+                    menu_item_id=item.menu_item_id,
+                    menu_item_name=entry.name,
+                    quantity=item.quantity,
+                    price=entry.price,
+                    special_requests=item.special_requests
+                ))
+        if errors:
+            raise HTTPException(status_code=422, detail=errors)
+        return priced
+
+menu_index = MenuPriceIndex()
+
+async def menu_changed():
+    menu_cache.invalidate()
+    await menu_index.load(db)
+
+def cached_json_response(request: Request, entry: CachedBody) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "X-Menu-Version": str(entry.version)}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# Order event log
+# Every order change is appended to `order_events` with the order's full
+# post-image and a per-order version. An in-memory projection of the open
+# orders and table occupancy is restored at startup from the latest snapshot
+# plus the events after it, applies local writes immediately and polls the
+# log for writes made on other workers. The highest version wins, so
+# re-reading an event is harmless.
+EVENT_LOG_POLL_SECONDS = float(os.environ.get('EVENT_LOG_POLL_SECONDS', '1'))
+EVENT_LOG_SNAPSHOT_SECONDS = float(os.environ.get('EVENT_LOG_SNAPSHOT_SECONDS', '300'))
+EVENT_LOG_SNAPSHOTS_KEPT = 12
+# Re-read window behind the watermark for events from workers with lagging clocks
+EVENT_LOG_GRACE = timedelta(seconds=float(os.environ.get('EVENT_LOG_GRACE_SECONDS', '5')))
+
+def order_view(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: document[name] for name in Order.model_fields if name in document}
+
+def order_event(event_type: str, order: Dict[str, Any], from_status: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "event_id": str(uuid.uuid4()),
+        "order_id": order["id"],
+        "version": order.get("version", 1),
+        "type": event_type,
+        "from_status": from_status,
+        "status": order["status"],
+        "table_number": order["table_number"],
+        "order": order_view(order),
+        "ts": datetime.utcnow(),
+    }
+
+class ActiveOrderBoard:
+    """Open orders by id, kept in created_at order with the serialized list cached."""
+
+    def __init__(self):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self._keys: List[Tuple[datetime, str]] = []
+        self._body: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(order_id)
+
+    def upsert(self, order: Dict[str, Any]):
+        self.remove(order["id"])
+        self.by_id[order["id"]] = order
+        bisect.insort(self._keys, (order["created_at"], order["id"]))
+        self._body = None
+
+    def remove(self, order_id: str) -> Optional[Dict[str, Any]]:
+        order = self.by_id.pop(order_id, None)
+        if order is not None:
+            index = bisect.bisect_left(self._keys, (order["created_at"], order_id))
+            del self._keys[index]
+            self._body = None
+        return order
+
+    def orders(self) -> List[Dict[str, Any]]:
+        return [self.by_id[order_id] for _, order_id in self._keys]
+
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = encode_event(self.orders())
+        return self._body
+
+class OrderProjection:
+    def __init__(self):
+        self.board = ActiveOrderBoard()  # open orders
+        self.tables: Dict[int, Set[str]] = {}  # table number -> open order ids
+        self.versions: Dict[str, int] = {}
+        self.closed_at: Dict[str, datetime] = {}
+        self.watermark: Optional[datetime] = None
+        self.applied_since_snapshot = 0
+
+    def apply(self, event: Dict[str, Any]) -> bool:
+        order_id = event["order_id"]
+        if event["version"] <= self.versions.get(order_id, 0):
+            return False
+        self.versions[order_id] = event["version"]
+        if self.watermark is None or event["ts"] > self.watermark:
+            self.watermark = event["ts"]
+        self.applied_since_snapshot += 1
+
+        order = dict(event["order"])
+        previous = self.board.remove(order_id)
+        if previous is not None:
+            self.tables.get(previous["table_number"], set()).discard(order_id)
+        if order["status"] in ACTIVE_ORDER_STATUSES:
+            self.board.upsert(order)
+            self.tables.setdefault(order["table_number"], set()).add(order_id)
+        else:
+            self.closed_at[order_id] = event["ts"]
+        return True
+
+    def prune(self):
+        # Versions of closed orders only matter while their events can still be re-read
+        if self.watermark is None:
+            return
+        horizon = self.watermark - 2 * EVENT_LOG_GRACE
+        for order_id in [oid for oid, ts in self.closed_at.items() if ts < horizon]:
+            del self.closed_at[order_id]
+            self.versions.pop(order_id, None)
+
+    def active_orders(self) -> List[Dict[str, Any]]:
+        return self.board.orders()
+
+    def occupancy(self) -> Dict[str, List[str]]:
+        # JSON object keys, so table numbers become strings
+        return {str(number): sorted(ids) for number, ids in sorted(self.tables.items()) if ids}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ts": self.watermark or datetime.utcnow(),
+            "orders": self.board.orders(),
+            "versions": [{"order_id": oid, "version": v} for oid, v in self.versions.items()],
+            "created_at": datetime.utcnow(),
+        }
+
+    def restore(self, snapshot: Dict[str, Any]):
+        self.__init__()
+        self.versions = {entry["order_id"]: entry["version"] for entry in snapshot["versions"]}
+        for order in snapshot["orders"]:
+            self.board.upsert(order)
+            self.tables.setdefault(order["table_number"], set()).add(order["id"])
+        self.watermark = snapshot["ts"]
+
+class OrderEventLog:
+    def __init__(self, database):
+        self.database = database
+        self.projection = OrderProjection()
+
+    async def append(self, events: List[Dict[str, Any]]):
+        for event in events:
+            self.projection.apply(event)
+        try:
+            await self.database.order_events.insert_many([dict(event) for event in events], ordered=False)
+        except BulkWriteError as e:
+            # A replayed event for the same (order_id, version) is already there
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                logger.error(f"Failed to append order events: {e}")
+        except Exception as e:
+            logger.error(f"Failed to append order events: {e}")
+
+    async def _replay(self, projection: OrderProjection, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Applies the matching events in order; returns the ones that were new to the projection."""
+        applied = []
+        cursor = self.database.order_events.find(query, {"_id": 0}).sort([("ts", 1), ("version", 1)])
+        async for event in cursor:
+            if projection.apply(event):
+                applied.append(event)
+        return applied
+
+    async def load(self):
+        # Orders stored before versioning would otherwise be seeded at version 1
+        # and have their first change, also version 1, dropped as stale
+        await self.database.orders.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+        snapshot = await self.database.order_snapshots.find_one({}, {"_id": 0}, sort=[("ts", -1)])
+        if snapshot:
+            self.projection.restore(snapshot)
+            await self._replay(self.projection, {"ts": {"$gte": snapshot["ts"] - EVENT_LOG_GRACE}})
+        else:
+            # First start on this database: seed from the orders collection and snapshot it
+            open_orders = await self.database.orders.find(
+                {"status": {"$in": ACTIVE_ORDER_STATUSES}}, {"_id": 0}
+            ).to_list(None)
+            self.projection = OrderProjection()
+            for order in open_orders:
+                self.projection.apply({**order_event("created", order), "ts": order.get("updated_at", order["created_at"])})
+            self.projection.watermark = datetime.utcnow()
+            await self.write_snapshot()
+
+    async def catch_up(self):
+        since = (self.projection.watermark or datetime.utcnow()) - EVENT_LOG_GRACE
+        # Local events were applied when appended, so these come from other workers
+        applied = await self._replay(self.projection, {"ts": {"$gte": since}})
+        table_occupancy.observe(applied)
+        self.projection.prune()
+
+    async def write_snapshot(self):
+        snapshot = self.projection.snapshot()
+        await self.database.order_snapshots.insert_one(snapshot)
+        self.projection.applied_since_snapshot = 0
+        kept = await self.database.order_snapshots.find({}, {"ts": 1}).sort("ts", -1).skip(EVENT_LOG_SNAPSHOTS_KEPT - 1).limit(1).to_list(1)
+        if kept:
+            await self.database.order_snapshots.delete_many({"ts": {"$lt": kept[0]["ts"]}})
+
+    async def run_forever(self):
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(EVENT_LOG_POLL_SECONDS)
+            try:
+                await self.catch_up()
+                if self.projection.applied_since_snapshot and time.monotonic() - last_snapshot >= EVENT_LOG_SNAPSHOT_SECONDS:
+                    await self.write_snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                logger.error(f"Order event log catch-up failed: {e}")
+
+    async def state_at(self, at: datetime) -> OrderProjection:
+        """Rebuilds the projection as of `at` from the nearest earlier snapshot."""
+        projection = OrderProjection()
+        snapshot = await self.database.order_snapshots.find_one({"ts": {"$lte": at}}, {"_id": 0}, sort=[("ts", -1)])
+        query: Dict[str, Any] = {"ts": {"$lte": at}}
+        if snapshot:
+            projection.restore(snapshot)
+            query["ts"]["$gte"] = snapshot["ts"] - EVENT_LOG_GRACE
+        await self._replay(projection, query)
+        return projection
+
+order_log = OrderEventLog(db)
+
+# Table occupancy engine
+# A table's status follows its open orders: OCCUPIED from the first one,
+# AVAILABLE once the last one is delivered or cancelled. The engine keeps the
+# open order ids per table and writes tables.status only when that derived
+# state flips, so further orders on a busy table cost no table write. Each
+# OCCUPIED spell is a session; finished ones go to `table_sessions` for
+# turnover analytics. Flips caused by other workers arrive through the event
+# log catch-up and are adopted without writing, since that worker wrote them.
+class TableOccupancy:
+    def __init__(self, collection: str = "table_sessions"):
+        self.collection = collection
+        self.open_orders: Dict[int, Set[str]] = {}  # table number -> open order ids
+        self.status: Dict[int, str] = {}  # table number -> status as stored
+        self.occupied_since: Dict[int, datetime] = {}
+        self.session_orders: Dict[int, int] = {}  # orders seated in the current session
+        self.writes = 0
+        self.skipped = 0
+        self._unwritten: Set[int] = set()  # flips whose table write failed, retried with the next one
+        self._unsaved: List[Dict[str, Any]] = []  # ended sessions whose insert failed, likewise
+        self._lock = asyncio.Lock()
+
+    def _derived(self, number: int) -> str:
+        return TableStatus.OCCUPIED if self.open_orders.get(number) else TableStatus.AVAILABLE
+
+    def apply(self, event: Dict[str, Any]) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Folds one order event in; returns whether the table flipped and the session it ended, if any."""
+        number = event["table_number"]
+        open_ids = self.open_orders.setdefault(number, set())
+        was_occupied = bool(open_ids)
+        if event["status"] in ACTIVE_ORDER_STATUSES:
+            if event["order_id"] not in open_ids:
+                open_ids.add(event["order_id"])
+                self.session_orders[number] = self.session_orders.get(number, 0) + 1
+        else:
+            open_ids.discard(event["order_id"])
+        if bool(open_ids) == was_occupied:
+            return False, None
+        if open_ids:
+            self.occupied_since[number] = event["ts"]
+            self.session_orders[number] = len(open_ids)
+            return True, None
+        del self.open_orders[number]
+        started = self.occupied_since.pop(number, event["ts"])
+        return True, {
+            "id": str(uuid.uuid4()),
+            "table_number": number,
+            "started_at": started,
+            "ended_at": event["ts"],
+            "minutes": (event["ts"] - started).total_seconds() / 60,
+            "orders": self.session_orders.pop(number, 0),
+        }
+
+    async def record(self, database, events: List[Dict[str, Any]]):
+        """
+        Applies events produced by this worker and writes the tables they
+        flipped. Write failures are logged, not raised: the orders behind the
+        events are already stored, and the next record retries the writes.
+        """
+        flipped: Set[int] = set()
+        sessions = []
+        for event in events:
+            changed, session = self.apply(event)
+            if changed:
+                flipped.add(event["table_number"])
+            elif event["type"] == "created" or event["status"] not in ACTIVE_ORDER_STATUSES:
+                # Used to be a blind OCCUPIED/AVAILABLE write
+                self.skipped += 1
+            if session is not None:
+                sessions.append(session)
+        if flipped or self._unwritten:
+            await self._write(database, flipped)
+        if sessions or self._unsaved:
+            await self._save_sessions(database, sessions)
+
+    async def _save_sessions(self, database, sessions: List[Dict[str, Any]]):
+        pending, self._unsaved = self._unsaved + sessions, []
+        try:
+            await database[self.collection].insert_many(pending, ordered=False)
+        except Exception as e:
+            if isinstance(e, BulkWriteError) and all(
+                error["code"] == 11000 for error in e.details.get("writeErrors", [])
+            ):
+                return  # the rest were stored by an earlier attempt
+            logger.error(f"Storing {len(pending)} table sessions failed, retrying with the next one: {e}")
+            self._unsaved = pending
+
+    def observe(self, events: List[Dict[str, Any]]):
+        """Adopts flips already written by another worker."""
+        for event in events:
+            changed, _ = self.apply(event)
+            if changed:
+                status = self._derived(event["table_number"])
+                self.status[event["table_number"]] = status
+                dashboard_stats.table_status_changed(status, number=event["table_number"])
+
+    async def _write(self, database, numbers: Iterable[int]):
+        # Serialized, and each write carries the state current when it runs, so
+        # a late write can never put back a status that was already superseded
+        async with self._lock:
+            updates = {}
+            for number in sorted(set(numbers) | self._unwritten):
+                status = self._derived(number)
+                if self.status.get(number) != status:
+                    updates[number] = status
+            # A failed flip that has since flipped back needs no write any more
+            self._unwritten.intersection_update(updates)
+            if not updates:
+                return
+            try:
+                await database.tables.bulk_write([
+                    UpdateOne({"number": number}, {"$set": {
+                        "status": status, "occupied_since": self.occupied_since.get(number), **sync_stamp()
+                    }})
+                    for number, status in updates.items()
+                ], ordered=False)
+            except Exception as e:
+                # The flip is already applied in memory; without this it would never be written
+                logger.error(f"Writing status of tables {sorted(updates)} failed, retrying with the next write: {e}")
+                self._unwritten.update(updates)
+                return
+            self._unwritten.difference_update(updates)
+            self.writes += len(updates)
+            for number, status in updates.items():
+                self.status[number] = status
+                dashboard_stats.table_status_changed(status, number=number)
+
+    async def load(self, database, projection: OrderProjection):
+        """Seeds from the tables and the event log projection, repairing statuses that disagree."""
+        tables = await database.tables.find({}, {"_id": 0, "number": 1, "status": 1, "occupied_since": 1}).to_list(1000)
+        self.status = {table["number"]: table["status"] for table in tables}
+        self.open_orders = {number: set(ids) for number, ids in projection.tables.items() if ids}
+        self.session_orders = {number: len(ids) for number, ids in self.open_orders.items()}
+        stored_since = {table["number"]: table.get("occupied_since") for table in tables}
+        self.occupied_since = {
+            number: stored_since.get(number) or min(projection.board.get(order_id)["created_at"] for order_id in ids)
+            for number, ids in self.open_orders.items()
+        }
+        # Only OCCUPIED is ours to undo; a RESERVED table without orders stays reserved
+        stale = [
+            number for number, status in self.status.items()
+            if (number in self.open_orders) != (status == TableStatus.OCCUPIED)
+        ]
+        await self._write(database, stale)
+
+    def table_added(self, table: Dict[str, Any]):
+        self.status[table["number"]] = table["status"]
+
+    def table_status_set(self, number: int, status: str):
+        # A manual status change; the next flip overrides it, as before
+        self.status[number] = status
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return [{
+            "table_number": number,
+            "status": self.status.get(number),
+            "open_orders": len(self.open_orders.get(number, ())),
+            "occupied_since": self.occupied_since.get(number),
+            "seated_minutes": round((now - self.occupied_since[number]).total_seconds() / 60, 2)
+            if number in self.occupied_since else None,
+        } for number in sorted(self.status.keys() | self.open_orders.keys())]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "table_count": len(self.status),
+            "occupied": len(self.open_orders),
+            "status_writes": self.writes,
+            "writes_skipped": self.skipped,
+        }
+
+table_occupancy = TableOccupancy()
+
+# Order transitions
+# Each status change is one conditional find_one_and_update: the filter only
+# matches orders whose current status may move to the target, so concurrent
+# changes cannot race past the state machine. The pre-image is returned (it
+# carries the old status the stats engine needs) and the post-image is
+# derived from it and the $set fields.
+ORDER_TRANSITIONS: Dict[OrderStatus, Set[OrderStatus]] = {
+    OrderStatus.PENDING: {OrderStatus.PREPARING, OrderStatus.CANCELLED},
+    OrderStatus.PREPARING: {OrderStatus.READY, OrderStatus.CANCELLED},
+    OrderStatus.READY: {OrderStatus.DELIVERED, OrderStatus.CANCELLED},
+    OrderStatus.DELIVERED: set(),
+    OrderStatus.CANCELLED: set(),
+}
+
+def transition_sources(target: OrderStatus) -> List[OrderStatus]:
+    return [source for source, targets in ORDER_TRANSITIONS.items() if target in targets]
+
+class LatencyTracker:
+    """Keeps the most recent samples per key for percentile reporting."""
+
+    def __init__(self, size: int = 2048):
+        self.size = size
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+
+    def record(self, key: str, seconds: float):
+        self.samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        report = {}
+        for key, samples in self.samples.items():
+            ordered = sorted(samples)
+            report[key] = {
+                "count": self.counts[key],
+                "p50_ms": ordered[int(0.50 * (len(ordered) - 1))] * 1000,
+                "p99_ms": ordered[int(0.99 * (len(ordered) - 1))] * 1000,
+                "max_ms": ordered[-1] * 1000,
+            }
+        return report
+
+transition_latency = LatencyTracker()
+
+async def transition_order(order_id: str, target: OrderStatus, event: Callable[[Dict[str, Any]], Event]) -> Dict[str, Any]:
+    """Applies one state machine transition and its side effects; returns the post-image."""
+    started = time.perf_counter()
+    if order_intake is not None and order_id in order_intake.unflushed:
+        # Accepted moments ago and still in the write-behind queue
+        if not await order_intake.wait_flushed(order_id):
+            raise HTTPException(status_code=503, detail="Order is not stored yet; retry shortly")
+    changes = {"status": target, **sync_stamp()}
+    before = await db.orders.find_one_and_update(
+        {"id": order_id, "status": {"$in": transition_sources(target)}},
+        {"$set": changes, "$inc": {"version": 1}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        # Only the failure path pays for a second read, to tell 404 from 409
+        existing = await db.orders.find_one({"id": order_id}, {"status": 1})
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        current = OrderStatus(existing["status"]).value
+        raise HTTPException(status_code=409, detail=f"Cannot change order from {current} to {target.value}")
+
+    after = {**before, **changes, "version": before.get("version", 0) + 1}
+    dashboard_stats.order_status_changed(before, target)
+
+    changed = order_event("status_changed", after, from_status=before["status"])
+    side_effects = [
+        order_log.append([changed]),
+        table_occupancy.record(db, [changed]),
+        manager.broadcast(event(after)),
+    ]
+    if target == OrderStatus.DELIVERED:
+        side_effects.append(revenue_rollups.record(db, after))
+    await asyncio.gather(*side_effects)
+
+    source = OrderStatus(before["status"]).value
+    transition_latency.record(f"{source}->{target.value}", time.perf_counter() - started)
+    return after
+
+# Write-behind order intake
+# With ORDER_INTAKE_MODE=write_behind, POST /orders and /orders/batch validate
+# and price orders, append them to a local journal and answer once the journal
+# write is on disk. A flusher then stores orders in batches (one insert_many,
+# one tables bulk_write, one broadcast) and marks them flushed in the journal.
+# On startup, journaled orders that were never marked flushed are stored
+# again. Until its batch lands, a new order is not yet visible to list reads.
+# The journal is locked by the process that owns it, so several workers need
+# one ORDER_JOURNAL_PATH each; a worker whose journal is taken fails startup.
+ORDER_INTAKE_MODE = os.environ.get('ORDER_INTAKE_MODE', 'direct')
+ORDER_JOURNAL_PATH = Path(os.environ.get('ORDER_JOURNAL_PATH', str(ROOT_DIR / 'order_intake.journal')))
+ORDER_JOURNAL_FSYNC = os.environ.get('ORDER_JOURNAL_FSYNC', 'true').lower() == 'true'
+# The journal is rewritten with only unflushed orders once it grows past this
+ORDER_JOURNAL_MAX_BYTES = int(os.environ.get('ORDER_JOURNAL_MAX_BYTES', str(64 * 1024 * 1024)))
+ORDER_INTAKE_BATCH_SIZE = int(os.environ.get('ORDER_INTAKE_BATCH_SIZE', '500'))
+ORDER_INTAKE_LINGER_SECONDS = float(os.environ.get('ORDER_INTAKE_LINGER_MS', '10')) / 1000
+# How long a status change on a still-queued order waits for its batch before a 503
+ORDER_INTAKE_FLUSH_WAIT_SECONDS = float(os.environ.get('ORDER_INTAKE_FLUSH_WAIT_SECONDS', '5'))
+
+async def record_new_orders(orders: List[Order]):
+    """Side effects of stored new orders: stats, event log, table status and one broadcast."""
+    for order in orders:
+        dashboard_stats.order_created(order.dict())
+    created = [order_event("created", order.dict()) for order in orders]
+    await asyncio.gather(order_log.append(created), table_occupancy.record(db, created))
+    await broadcast_new_orders(orders)
+
+async def broadcast_new_orders(orders: List[Order]):
+    topics = set()
+    for order in orders:
+        topics.update(order_topics(order.table_number, order.waiter_name))
+    await manager.broadcast(Event({
+        "type": "new_orders",
+        "orders": [order.dict() for order in orders],
+        "timestamp": datetime.utcnow()
+    }, topics=topics))
+
+class OrderIntake:
+    def __init__(self, path: Path = ORDER_JOURNAL_PATH, batch_size: int = ORDER_INTAKE_BATCH_SIZE,
+                 linger: float = ORDER_INTAKE_LINGER_SECONDS, fsync: bool = ORDER_JOURNAL_FSYNC,
+                 max_bytes: int = ORDER_JOURNAL_MAX_BYTES, flush_wait: float = ORDER_INTAKE_FLUSH_WAIT_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.linger = linger
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.flush_wait = flush_wait
+        self.unflushed: Dict[str, Order] = {}  # journaled, not yet in Mongo
+        self.keys: Dict[str, str] = {}  # idempotency key -> id, for unflushed batch orders
+        self.key_of: Dict[str, str] = {}  # id -> idempotency key
+        self.accepted = 0
+        self.flushed = 0
+        self.recovered = 0
+        self.batches = 0
+        self._file = None
+        self._lock_file = None
+        self._size = 0
+        self._compact_at = max_bytes
+        self._appends: List[Tuple[bytes, asyncio.Future]] = []
+        self._wake = asyncio.Event()
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._flush_done = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # Journal
+    def _lock_journal(self):
+        # Two processes on one journal would each rewrite it without the other's orders
+        self._lock_file = open(self.path.with_name(self.path.name + ".lock"), "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(
+                f"Order journal {self.path} is in use by another process; give each worker its own "
+                f"ORDER_JOURNAL_PATH or run write_behind with a single worker"
+            )
+
+    def _read_journal(self) -> List[Tuple[Order, Optional[str]]]:
+        orders: Dict[str, Tuple[Order, Optional[str]]] = {}
+        if not self.path.exists():
+            return []
+        with open(self.path, "rb") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write from a crash mid-append
+                if record.get("op") == "order":
+                    order = Order(**record["order"])
+                    orders[order.id] = (order, record.get("idempotency_key"))
+                elif record.get("op") == "flushed":
+                    for order_id in record["ids"]:
+                        orders.pop(order_id, None)
+        return list(orders.values())
+
+    def _rewrite(self, orders: List[Tuple[Order, Optional[str]]]):
+        # Keep only unflushed orders; the rename makes the swap atomic and the
+        # handle that wrote the new file keeps appending to it, so a failure at
+        # any step leaves the current journal in use
+        temporary = self.path.with_suffix(".tmp")
+        journal = open(temporary, "wb")
+        try:
+            for order, key in orders:
+                journal.write(self._order_line(order, key))
+            journal.flush()
+            os.fsync(journal.fileno())
+            os.replace(temporary, self.path)
+        except BaseException:
+            journal.close()
+            temporary.unlink(missing_ok=True)
+            raise
+        previous, self._file = self._file, journal
+        if previous is not None:
+            previous.close()
+        self._size = journal.tell()
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._size += len(data)
+
+    @staticmethod
+    def _order_line(order: Order, key: Optional[str]) -> bytes:
+        record = {"op": "order", "order": order.dict()}
+        if key is not None:
+            record["idempotency_key"] = key
+        return encode_event(record) + b"\n"
+
+    def _pending(self) -> List[Tuple[Order, Optional[str]]]:
+        return [(order, self.key_of.get(order_id)) for order_id, order in self.unflushed.items()]
+
+    def _register(self, order: Order, key: Optional[str]):
+        self.unflushed[order.id] = order
+        if key is not None:
+            self.keys[key] = order.id
+            self.key_of[order.id] = key
+
+    def _forget(self, order_id: str):
+        self.unflushed.pop(order_id, None)
+        key = self.key_of.pop(order_id, None)
+        if key is not None:
+            self.keys.pop(key, None)
+
+    async def _append(self, data: bytes):
+        if self._writer is None or self._writer.done():
+            raise RuntimeError("Order journal writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._appends.append((data, future))
+        self._wake.set()
+        await future
+
+    @staticmethod
+    def _fail(appends: List[Tuple[bytes, asyncio.Future]], error: BaseException):
+        for _, future in appends:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _compact(self):
+        # submit() registers orders before appending, so the snapshot has
+        # every order written so far
+        try:
+            await asyncio.to_thread(self._rewrite, self._pending())
+        except Exception as e:
+            # Keep appending to the current journal and try again once it has
+            # grown by another max_bytes
+            logger.error(f"Order journal compaction failed: {e}")
+            self._compact_at = self._size + self.max_bytes
+        else:
+            self._compact_at = self.max_bytes
+
+    async def _journal_writer(self):
+        # Group commit: every append queued while a write is in flight shares the next fsync
+        appends: List[Tuple[bytes, asyncio.Future]] = []
+        try:
+            while True:
+                await self._wake.wait()
+                self._wake.clear()
+                appends, self._appends = self._appends, []
+                if not appends:
+                    continue
+                try:
+                    await asyncio.to_thread(self._write, b"".join(data for data, _ in appends))
+                except Exception as e:
+                    logger.error(f"Order journal write failed: {e}")
+                    self._fail(appends, e)
+                    continue
+                for _, future in appends:
+                    if not future.done():
+                        future.set_result(None)
+                if self._size > self._compact_at:
+                    await self._compact()
+        finally:
+            # Nobody resolves these once the writer is gone
+            error = RuntimeError("Order journal writer stopped")
+            self._fail(appends, error)
+            self._fail(self._appends, error)
+            self._appends = []
+
+    # Flushing to Mongo
+    async def _next_batch(self) -> List[Order]:
+        batch = [await self._ready.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._ready.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _store(self, batch: List[Order]) -> Tuple[List[Order], List[str]]:
+        """Inserts the batch; returns the orders inserted now and the ids that were already there."""
+        documents = []
+        for order in batch:
+            document = {**order.dict(), "version": 1, "sync_seq": sync_clock.next()}
+            if order.id in self.key_of:
+                document["idempotency_key"] = self.key_of[order.id]
+            documents.append(document)
+        try:
+            await db.orders.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            duplicates = [documents[error["index"]]["id"] for error in errors]
+            return [order for order in batch if order.id not in set(duplicates)], duplicates
+        return batch, []
+
+    async def _record_stored(self, ids: List[str]):
+        """
+        Side effects for orders an earlier attempt already stored: a crash
+        before the flushed marker, or record_new_orders failing after the
+        insert. The event log dedupes on (order_id, version) and occupancy is
+        keyed by order id, so both run again from the stored documents; the
+        count and the broadcast only when the created event never made it.
+        """
+        documents = await db.orders.find({"id": {"$in": ids}}, {"_id": 0}).to_list(None)
+        logged = {
+            event["order_id"] for event in await db.order_events.find(
+                {"order_id": {"$in": ids}, "type": "created"}, {"_id": 0, "order_id": 1}
+            ).to_list(None)
+        }
+        lost = set(ids) - {document["id"] for document in documents}
+        if lost:
+            # Not there by id, so the clash was on idempotency_key: a replay of
+            # the same device order that raced this one into the journal
+            logger.warning(f"Dropped {len(lost)} journaled orders whose idempotency key was already stored")
+        events = [order_event("created", document) for document in documents]
+        await asyncio.gather(order_log.append(events), table_occupancy.record(db, events))
+        missed = [Order(**document) for document in documents if document["id"] not in logged]
+        for order in missed:
+            dashboard_stats.order_created(order.dict())
+        if missed:
+            await broadcast_new_orders(missed)
+
+    async def _flusher(self):
+        while True:
+            batch = await self._next_batch()
+            while True:
+                try:
+                    inserted, duplicates = await self._store(batch)
+                    if inserted:
+                        await record_new_orders(inserted)
+                    if duplicates:
+                        await self._record_stored(duplicates)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The orders stay journaled; keep retrying until Mongo is back
+                    logger.error(f"Order intake flush of {len(batch)} orders failed, retrying: {e}")
+                    await asyncio.sleep(1.0)
+            ids = [order.id for order in batch]
+            try:
+                await self._append(encode_event({"op": "flushed", "ids": ids}) + b"\n")
+            except Exception as e:
+                # Without the marker a restart stores the batch again, which
+                # lands on the duplicate path; the next compaction drops them
+                logger.error(f"Order journal flushed marker for {len(ids)} orders failed: {e}")
+            for order_id in ids:
+                self._forget(order_id)
+            self.flushed += len(batch)
+            self.batches += 1
+            self._flush_done.set()
+            self._flush_done = asyncio.Event()
+
+    # Lifecycle and API
+    async def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_journal()
+        for order, key in await asyncio.to_thread(self._read_journal):
+            self._register(order, key)
+        await asyncio.to_thread(self._rewrite, self._pending())
+        self.recovered = len(self.unflushed)
+        if self.recovered:
+            logger.warning(f"Replaying {self.recovered} journaled orders that were never stored")
+        for order in self.unflushed.values():
+            self._ready.put_nowait(order)
+        self._writer = asyncio.create_task(self._journal_writer())
+        self._tasks = [self._writer, asyncio.create_task(self._flusher())]
+
+    async def stop(self, timeout: float = 10.0):
+        deadline = time.monotonic() + timeout
+        while self.unflushed and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        if self._file is not None:
+            self._file.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+        if self.unflushed:
+            logger.warning(f"{len(self.unflushed)} orders left in the journal; they are stored on next startup")
+
+    async def submit(self, orders: List[Order], keys: Optional[List[str]] = None):
+        """Returns once the orders are durable in the journal; `keys` are their idempotency keys."""
+        entries = list(zip(orders, keys or [None] * len(orders)))
+        # Registered before the first await, so queued() sees them at once
+        for order, key in entries:
+            self._register(order, key)
+        try:
+            await self._append(b"".join(self._order_line(order, key) for order, key in entries))
+        except Exception:
+            for order in orders:
+                self._forget(order.id)
+            raise
+        self.accepted += len(orders)
+        for order in orders:
+            self._ready.put_nowait(order)
+
+    def queued(self, keys: Iterable[str]) -> Dict[str, Order]:
+        """Unflushed orders by idempotency key."""
+        return {key: self.unflushed[self.keys[key]] for key in keys if key in self.keys}
+
+    async def wait_flushed(self, order_id: str) -> bool:
+        """Waits for the order's batch to be stored; False if it is still queued after flush_wait."""
+        deadline = time.monotonic() + self.flush_wait
+        while order_id in self.unflushed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._flush_done.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": ORDER_INTAKE_MODE,
+            "journal": str(self.path),
+            "journal_bytes": self._size,
+            "unflushed": len(self.unflushed),
+            "accepted": self.accepted,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "recovered": self.recovered,
+        }
+
+if ORDER_INTAKE_MODE not in ("direct", "write_behind"):
+    raise ValueError(f"Unknown order intake mode: {ORDER_INTAKE_MODE}")
+order_intake: Optional[OrderIntake] = OrderIntake() if ORDER_INTAKE_MODE == "write_behind" else None
+
 # WebSocket endpoint
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, resume_from: Optional[int] = None,
+                             stream: Optional[str] = None, topics: Optional[str] = None,
+                             encoding: str = "json"):
+    """
+    ?encoding=compact (short-key JSON) or msgpack switches events to binary
+    frames in the compact format; see /api/ws/formats for the key map.
+    The first frame is {"type": "hello", "stream": ..., "seq": ...}. Broadcast
+    events carry "seq"; a client that reconnects with ?resume_from=<last seq>
+    &stream=<stream> gets the events it missed, or {"type": "resync"} when
+    they are no longer buffered and it must refetch. ?topics=a,b subscribes
+    before the replay so only matching events are replayed.
+    """
+    initial = [topic for topic in topics.split(",") if topic] if topics else None
+    if encoding not in WIRE_ENCODINGS or (encoding == "msgpack" and msgpack is None):
+        # Unknown or unavailable formats fall back to JSON; hello reports what was picked
+        encoding = "json"
+    if not await manager.connect(websocket, resume_from=resume_from, stream=stream, topics=initial, encoding=encoding):
+        return
     try:
         while True:
             data = await websocket.receive_text()
-            # Echo back for now (can be enhanced for specific message handling)
-            await manager.send_personal_message(f"Message received: {data}", websocket)
+            manager.touch(websocket)
+            await handle_client_message(websocket, data)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+def active_orders_snapshot(topics: Set[str]) -> Event:
+    orders = order_log.projection.active_orders()
+    if ALL_TOPICS not in topics:
+        orders = [
+            order for order in orders
+            if topics.intersection(order_topics(order["table_number"], order.get("waiter_name")))
+        ]
+    return Event({"type": "active_orders", "orders": orders, "timestamp": datetime.utcnow()})
+
+async def handle_client_message(websocket: WebSocket, data: str):
+    """
+    Client protocol:
+      {"action": "subscribe", "topics": ["orders"], "tables": [3], "waiters": ["Ana"]}
+      {"action": "unsubscribe", "topics": ["table:3"]}
+      {"action": "snapshot"}  -> the open orders matching the client's subscriptions
+      {"action": "pong"}      -> answer to the server's {"type": "ping"} heartbeat
+    """
+    try:
+        message = json.loads(data)
+        action = message["action"]
+        topics = [str(topic) for topic in message.get("topics", [])]
+        topics += [f"table:{int(number)}" for number in message.get("tables", [])]
+        topics += [f"waiter:{name}" for name in message.get("waiters", [])]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        await manager.send_personal_message(json.dumps({"type": "error", "detail": "Invalid message"}), websocket)
+        return
+
+    if action == "pong":
+        return  # receiving it already refreshed last_seen
+    if action == "snapshot":
+        await manager.send_personal_message(active_orders_snapshot(manager.topics(websocket)), websocket)
+        return
+    if action == "subscribe":
+        current = manager.subscribe(websocket, topics)
+    elif action == "unsubscribe":
+        current = manager.unsubscribe(websocket, topics)
+    else:
+        await manager.send_personal_message(json.dumps({"type": "error", "detail": f"Unknown action: {action}"}), websocket)
+        return
+    await manager.send_personal_message(json.dumps({"type": "subscriptions", "topics": current}), websocket)
+
+@api_router.get("/ws/stats")
+async def get_websocket_stats():
+    return manager.stats()
+
+@api_router.get("/ws/formats")
+async def get_wire_formats():
+    return {
+        "encodings": [encoding for encoding in WIRE_ENCODINGS if encoding != "msgpack" or msgpack is not None],
+        "keys": COMPACT_KEYS,
+        "time_keys": sorted(COMPACT_TIME_KEYS),
+        "item": ["menu_item_id", "quantity", "special_requests"],
+    }
+
 # Menu endpoints
+async def load_menu() -> List[Dict[str, Any]]:
+    menu_items = await db.menu_items.find({"available": True}, model_projection(MenuItem)).to_list(1000)
+    return with_model_defaults(MenuItem, menu_items)
+
+async def load_menu_categories() -> List[Dict[str, Any]]:
+    pipeline = [
+        {"$match": {"available": True}},
+        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ]
+    categories = await db.menu_items.aggregate(pipeline).to_list(100)
+    return [{"category": cat["_id"], "count": cat["count"]} for cat in categories]
+
 @api_router.get("/menu", response_model=List[MenuItem])
-async def get_menu():
-    menu_items = await db.menu_items.find({"available": True}).to_list(1000)
-    return [MenuItem(**item) for item in menu_items]
+async def get_menu(request: Request):
+    return cached_json_response(request, await menu_cache.get("menu", load_menu))
 
 @api_router.post("/menu", response_model=MenuItem)
 async def create_menu_item(item: MenuItemCreate):
     menu_item = MenuItem(**item.dict())
     await db.menu_items.insert_one(menu_item.dict())
+    await menu_changed()
     return menu_item
 
 @api_router.get("/menu/categories")
-async def get_menu_categories():
-    pipeline = [
-        {"$match": {"available": True}},
-        {"$group": {"_id": "$category", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]
-    categories = await db.menu_items.aggregate(pipeline).to_list(100)
-    return [{"category": cat["_id"], "count": cat["count"]} for cat in categories]
+async def get_menu_categories(request: Request):
+    return cached_json_response(request, await menu_cache.get("categories", load_menu_categories))
 
 # Table endpoints
 @api_router.get("/tables", response_model=List[Table])
 async def get_tables():
-    tables = await db.tables.find().sort("number", 1).to_list(1000)
-    return [Table(**table) for table in tables]
+    tables = await db.tables.find({}, model_projection(Table)).sort("number", 1).to_list(1000)
+    return FastJSONResponse(with_model_defaults(Table, tables))
 
 @api_router.post("/tables", response_model=Table)
 async def create_table(table: TableCreate):
-    # Check if table number already exists
-    existing = await db.tables.find_one({"number": table.number})
-    if existing:
-        raise HTTPException(status_code=400, detail="Table number already exists")
-    
+    # The unique index on tables.number rejects duplicates atomically
+    if ("tables", "number_unique") in missing_indexes:
+        # Without it (legacy duplicates blocked the build) fall back to a racy check
+        if await db.tables.find_one({"number": table.number}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Table number already exists")
     new_table = Table(**table.dict())
-    await db.tables.insert_one(new_table.dict())
+    try:
+        await db.tables.insert_one({**new_table.dict(), **sync_stamp()})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Table number already exists")
+    dashboard_stats.table_added(new_table.dict())
+    table_occupancy.table_added(new_table.dict())
     return new_table
 
+@api_router.get("/tables/occupancy")
+async def get_table_occupancy():
+    """Open orders and current session length per table, from the occupancy engine."""
+    return FastJSONResponse({
+        "tables": table_occupancy.snapshot(),
+        **table_occupancy.stats(),
+    })
+
 @api_router.put("/tables/{table_id}")
 async def update_table_status(table_id: str, status: TableStatus):
-    result = await db.tables.update_one(
+    table = await db.tables.find_one_and_update(
         {"id": table_id},
-        {"$set": {"status": status}}
+        {"$set": {"status": status, **sync_stamp()}},
+        projection={"_id": 0, "number": 1}
     )
-    if result.matched_count == 0:
+    if table is None:
         raise HTTPException(status_code=404, detail="Table not found")
+    dashboard_stats.table_status_changed(status, table_id=table_id)
+    table_occupancy.table_status_set(table["number"], status)
     return {"message": "Table status updated"}
 
 # Order endpoints
+ORDERS_PAGE_MAX = 1000
+EXPORT_BATCH_SIZE = 1000
+
+def encode_order_cursor(order: Dict[str, Any]) -> str:
+    raw = f"{order['created_at'].isoformat()}|{order['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_order_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Orders are listed newest first, so the next page is strictly older
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": order_id}},
+    ]}
+
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders():
-    orders = await db.orders.find().sort("created_at", -1).to_list(1000)
-    return [Order(**order) for order in orders]
+async def get_orders(limit: int = Query(100, ge=1, le=ORDERS_PAGE_MAX), after: Optional[str] = None):
+    """Newest first. When more orders exist, X-Next-Cursor holds the `after` value for the next page."""
+    query = decode_order_cursor(after) if after else {}
+    orders = await db.orders.find(query, model_projection(Order)).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(orders) > limit:
+        orders = orders[:limit]
+        headers["X-Next-Cursor"] = encode_order_cursor(orders[-1])
+    return FastJSONResponse(with_model_defaults(Order, orders), headers=headers)
+
+@api_router.get("/orders/export")
+async def export_orders(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Streams the order history as NDJSON, oldest first, without buffering it in memory."""
+    query: Dict[str, Any] = {}
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+
+    async def ndjson_lines():
+        cursor = db.orders.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+        async for order in cursor:
+            yield encode_event(order) + b"\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="orders.ndjson"'}
+    )
 
 @api_router.get("/orders/active", response_model=List[Order])
 async def get_active_orders():
-    active_statuses = [OrderStatus.PENDING, OrderStatus.PREPARING, OrderStatus.READY]
-    orders = await db.orders.find({"status": {"$in": active_statuses}}).sort("created_at", 1).to_list(1000)
-    return [Order(**order) for order in orders]
+    # Served from the in-memory board; the encoded list is reused until an order changes
+    return Response(content=order_log.projection.board.body(), media_type="application/json")
+
+@api_router.get("/orders/state")
+async def get_orders_state(at: datetime):
+    """Open orders and table occupancy as they were at `at` (UTC), rebuilt from the event log."""
+    projection = await order_log.state_at(at)
+    return FastJSONResponse({
+        "at": at,
+        "orders": projection.active_orders(),
+        "tables": projection.occupancy(),
+    })
+
+@api_router.get("/orders/{order_id}/events")
+async def get_order_events(order_id: str):
+    events = await db.order_events.find({"order_id": order_id}, {"_id": 0}).sort("version", 1).to_list(1000)
+    if not events:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return FastJSONResponse(events)
+
+def build_order(order: OrderCreate) -> Order:
+    # Price from the menu index, never from the client
+    items = menu_index.price_items(order.items)
+    total = sum(item.price * item.quantity for item in items)
+    return Order(**order.dict(exclude={"idempotency_key", "items"}), items=items, total_amount=total)
 
 @api_router.post("/orders", response_model=Order)
 async def create_order(order: OrderCreate):
-    # Calculate total amount
-    total = sum(item.price * item.quantity for item in order.items)
-    
     # Create order
-    new_order = Order(**order.dict(), total_amount=total)
-    await db.orders.insert_one(new_order.dict())
+    await menu_index.ensure_fresh(db, [item.menu_item_id for item in order.items])
+    new_order = build_order(order)
+    if order_intake is not None:
+        await order_intake.submit([new_order])
+        return new_order
+    await db.orders.insert_one({**new_order.dict(), "version": 1, "sync_seq": sync_clock.next()})
+    dashboard_stats.order_created(new_order.dict())
     
-    # Update table status to occupied
-    await db.tables.update_one(
-        {"number": order.table_number},
-        {"$set": {"status": TableStatus.OCCUPIED}}
-    )
+    # Record the event; the table is only written if this order occupies it
+    created = order_event("created", new_order.dict())
+    await asyncio.gather(order_log.append([created]), table_occupancy.record(db, [created]))
     
     # Broadcast new order to all connected clients
-    await manager.broadcast(json.dumps({
+    await manager.broadcast(Event({
         "type": "new_order",
         "order": new_order.dict(),
-        "timestamp": datetime.utcnow().isoformat()
-    }, default=str))
+        "timestamp": datetime.utcnow()
+    }, topics=order_topics(new_order.table_number, new_order.waiter_name)))
     
     return new_order
 
+def batch_result(keys: List[str], created: Dict[str, Order], stored: Dict[str, Order],
+                 rejected: Dict[str, OrderBatchRejection]) -> OrderBatchResult:
+    results = []
+    for key in dict.fromkeys(keys):
+        if key not in rejected:
+            results.append(created.get(key) or stored[key])
+    return OrderBatchResult(
+        orders=results,
+        created=len(created),
+        replayed=len(results) - len(created),
+        rejected=list(rejected.values())
+    )
+
+@api_router.post("/orders/batch", response_model=OrderBatchResult)
+async def create_orders_batch(batch: OrderBatch):
+    """
+    Submits orders queued on a device in one request: one insert_many, one
+    bulk_write for the tables and one coalesced broadcast. Items whose
+    idempotency_key was already stored are returned as replayed; repeated
+    keys within one batch collapse to a single order. In write_behind mode
+    the new orders go through the intake journal instead.
+    """
+    keys = [item.idempotency_key for item in batch.orders]
+    await menu_index.ensure_fresh(db, [line.menu_item_id for item in batch.orders for line in item.items])
+    # Write-behind: keys still in the journal count as stored. Checked before
+    # the query (in case they get flushed meanwhile) and after it
+    queued = order_intake.queued(keys) if order_intake is not None else {}
+    stored = {
+        doc["idempotency_key"]: Order(**doc)
+        for doc in await db.orders.find({"idempotency_key": {"$in": keys}}).to_list(len(keys))
+    }
+    if order_intake is not None:
+        queued.update(order_intake.queued(keys))
+    for key, order in queued.items():
+        stored.setdefault(key, order)
+
+    pending: Dict[str, Order] = {}
+    rejected: Dict[str, OrderBatchRejection] = {}
+    for item in batch.orders:
+        key = item.idempotency_key
+        if key in stored or key in pending or key in rejected:
+            continue
+        try:
+            new_order = build_order(item)
+        except HTTPException as e:
+            # Reject just this order so one bad item cannot block a device's queue
+            rejected[key] = OrderBatchRejection(idempotency_key=key, errors=e.detail)
+            continue
+        pending[key] = new_order
+
+    if order_intake is not None:
+        if pending:
+            await order_intake.submit(list(pending.values()), keys=list(pending.keys()))
+        return batch_result(keys, pending, stored, rejected)
+
+    documents = [
+        {**order.dict(), "idempotency_key": key, "version": 1, "sync_seq": sync_clock.next()}
+        for key, order in pending.items()
+    ]
+    if documents:
+        try:
+            await db.orders.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            # A concurrent replay of the same batch stored these keys first
+            raced = [documents[error["index"]]["idempotency_key"] for error in errors]
+            for key in raced:
+                pending.pop(key)
+            for doc in await db.orders.find({"idempotency_key": {"$in": raced}}).to_list(len(raced)):
+                stored[doc["idempotency_key"]] = Order(**doc)
+
+    if pending:
+        await record_new_orders(list(pending.values()))
+    return batch_result(keys, pending, stored, rejected)
+
 @api_router.put("/orders/{order_id}/status")
 async def update_order_status(order_id: str, status_update: OrderStatusUpdate):
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
-            "status": status_update.status,
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Get updated order
-    order = await db.orders.find_one({"id": order_id})
-    
-    # If order is delivered, update table status
-    if status_update.status == OrderStatus.DELIVERED:
-        await db.tables.update_one(
-            {"number": order["table_number"]},
-            {"$set": {"status": TableStatus.AVAILABLE}}
-        )
-    
-    # Broadcast status update
-    await manager.broadcast(json.dumps({
+    await transition_order(order_id, status_update.status, lambda order: Event({
         "type": "order_status_update",
         "order_id": order_id,
         "status": status_update.status,
         "table_number": order["table_number"],
-        "timestamp": datetime.utcnow().isoformat()
-    }))
+        "timestamp": datetime.utcnow()
+    }, topics=order_topics(order["table_number"], order.get("waiter_name"))))
     
     return {"message": "Order status updated"}
 
 @api_router.delete("/orders/{order_id}")
 async def cancel_order(order_id: str):
-    # Get order first to get table number
-    order = await db.orders.find_one({"id": order_id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Update order status to cancelled
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {
-            "status": OrderStatus.CANCELLED,
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
-    # Update table status to available
-    await db.tables.update_one(
-        {"number": order["table_number"]},
-        {"$set": {"status": TableStatus.AVAILABLE}}
-    )
-    
-    # Broadcast cancellation
-    await manager.broadcast(json.dumps({
+    await transition_order(order_id, OrderStatus.CANCELLED, lambda order: Event({
         "type": "order_cancelled",
         "order_id": order_id,
         "table_number": order["table_number"],
-        "timestamp": datetime.utcnow().isoformat()
-    }))
+        "timestamp": datetime.utcnow()
+    }, topics=order_topics(order["table_number"], order.get("waiter_name"))))
     
     return {"message": "Order cancelled"}
 
+# Delta sync endpoint
+@api_router.get("/sync")
+async def sync_changes(since: int = 0):
+    """
+    Returns orders and tables changed after the `since` cursor. since=0 is a
+    full sync (active orders and all tables). Changed orders include ones that
+    just left the active set so clients can drop them; duplicates from the
+    grace window are expected and should be merged by id.
+    """
+    cursor = sync_clock.next()
+    projection = {"_id": 0}
+    full = since <= 0 or since < cursor - SYNC_MAX_LAG_US
+    if not full:
+        changed = {"sync_seq": {"$gt": since - SYNC_GRACE_US}}
+        orders = await db.orders.find(changed, projection).to_list(SYNC_BATCH_LIMIT)
+        tables = await db.tables.find(changed, projection).to_list(SYNC_BATCH_LIMIT)
+        full = len(orders) >= SYNC_BATCH_LIMIT or len(tables) >= SYNC_BATCH_LIMIT
+    if full:
+        orders = await db.orders.find({"status": {"$in": ACTIVE_ORDER_STATUSES}}, projection).to_list(SYNC_BATCH_LIMIT)
+        tables = await db.tables.find({}, projection).to_list(SYNC_BATCH_LIMIT)
+    return {
+        "cursor": cursor,
+        "full": full,
+        "orders": orders,
+        "tables": tables,
+    }
+
 # Dashboard stats
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats():
-    # Count orders by status
-    pipeline = [
-        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]
-    order_stats = await db.orders.aggregate(pipeline).to_list(100)
-    
-    # Count tables by status
-    table_pipeline = [
-        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
-    ]
-    table_stats = await db.tables.aggregate(table_pipeline).to_list(100)
-    
-    # Today's revenue
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    revenue_pipeline = [
-        {"$match": {
-            "created_at": {"$gte": today_start},
-            "status": {"$in": [OrderStatus.DELIVERED]}
-        }},
-        {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}
-    ]
-    revenue_result = await db.orders.aggregate(revenue_pipeline).to_list(1)
-    today_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
     return {
-        "orders": {stat["_id"]: stat["count"] for stat in order_stats},
-        "tables": {stat["_id"]: stat["count"] for stat in table_stats},
-        "today_revenue": today_revenue,
+        **dashboard_stats.snapshot(),
         "timestamp": datetime.utcnow().isoformat()
     }
 
+# Analytics
+@api_router.get("/analytics/revenue")
+async def get_revenue_series(
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    tz: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """
+    Revenue, order count and average ticket per local hour or day, zero-filled.
+    Naive start/end are read in `tz`; the default window is the last 7 days.
+    """
+    return await revenue_rollups.series(db, granularity, tz, start, end)
+
+@api_router.get("/analytics/today")
+async def get_revenue_today(tz: Optional[str] = None):
+    tz, zone = revenue_rollups.zone(tz)
+    today = datetime.utcnow().replace(tzinfo=timezone.utc).astimezone(zone).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    series = await revenue_rollups.series(db, "day", tz, today, None)
+    return {"tz": tz, **series["buckets"][0]}
+
+@api_router.get("/analytics/items")
+async def get_top_items(
+    tz: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=100),
+):
+    return await revenue_rollups.top_items(db, tz, start, end, limit)
+
+@api_router.get("/analytics/report")
+async def get_analytics_report(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=100),
+):
+    """Top items, average ticket, table turnover and waiter throughput over [since, until) UTC (default 30 days)."""
+    since, until = analytics_window(since, until)
+    orders, lines = await asyncio.gather(load_orders_frame(db, since, until), load_lines_frame(db, since, until))
+    # The groupbys are CPU-bound; keep them off the event loop
+    report = await asyncio.to_thread(analytics_report, orders, lines, limit)
+    return {"since": since, "until": until, **report}
+
+@api_router.get("/analytics/tables")
+async def get_table_sessions_report(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Per-table turnover from finished table sessions over [since, until) UTC, plus the ones still open."""
+    since, until = analytics_window(since, until)
+    sessions = await load_sessions_frame(db, since, until)
+    report = await asyncio.to_thread(table_sessions_report, sessions, since, until)
+    return {
+        "since": since,
+        "until": until,
+        "tables": report,
+        "open": [table for table in table_occupancy.snapshot() if table["open_orders"]],
+    }
+
+@api_router.get("/analytics/export")
+async def export_analytics(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    dataset: str = Query("lines", pattern="^(orders|lines|sessions)$"),
+    format: str = Query("parquet", pattern="^(parquet|csv)$"),
+):
+    """Columnar dump of orders, flattened line items or table sessions for offline analysis."""
+    since, until = analytics_window(since, until)
+    load = {"orders": load_orders_frame, "lines": load_lines_frame, "sessions": load_sessions_frame}[dataset]
+    frame = await load(db, since, until)
+    if format == "csv":
+        body = await asyncio.to_thread(lambda: frame.to_csv(index=False).encode("utf-8"))
+        media_type = "text/csv"
+    else:
+        body = await asyncio.to_thread(lambda: frame.to_parquet(index=False))
+        media_type = "application/vnd.apache.parquet"
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{format}"'}
+    )
+
+@api_router.post("/analytics/rebuild")
+async def rebuild_revenue_rollups():
+    delivered = await revenue_rollups.rebuild(db)
+    return {"message": "Revenue rollups rebuilt", "orders": delivered}
+
+# Admin
+@api_router.get("/admin/transitions")
+async def get_transition_latency():
+    return transition_latency.summary()
+
+@api_router.get("/admin/intake")
+async def get_intake_stats():
+    if order_intake is None:
+        return {"mode": ORDER_INTAKE_MODE}
+    return order_intake.stats()
+
+@api_router.get("/admin/indexes")
+async def get_index_usage():
+    return await index_report(db)
+
 # Initialize default data
 @api_router.post("/init-data")
 async def initialize_default_data():
@@ -350,13 +2968,41 @@ async def initialize_default_data():
     
     menu_items = [MenuItem(**item) for item in default_menu]
     await db.menu_items.insert_many([item.dict() for item in menu_items])
+    await menu_changed()
     
     # Create default tables
     default_tables = [Table(number=i, capacity=4) for i in range(1, 11)]
-    await db.tables.insert_many([table.dict() for table in default_tables])
+    await db.tables.insert_many([{**table.dict(), **sync_stamp()} for table in default_tables])
+    for table in default_tables:
+        dashboard_stats.table_added(table.dict())
+        table_occupancy.table_added(table.dict())
     
     return {"message": "Default data initialized successfully"}
 
+# Health
+@api_router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness(request: Request):
+    """503 until startup has finished, and whenever Mongo doesn't answer a ping in time."""
+    if not getattr(request.app.state, "ready", False):
+        raise HTTPException(status_code=503, detail="Starting up")
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=MONGO_READY_TIMEOUT_SECONDS)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"MongoDB unavailable: {e}")
+    return {"status": "ready", "mongo_ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+@api_router.get("/health/pool")
+async def get_pool_stats():
+    return {
+        "pool": pool_stats.snapshot(),
+        "options": mongo_client_options(),
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -366,8 +3012,65 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cross-origin scripts only see safelisted response headers otherwise
+    expose_headers=["X-Next-Cursor", "X-Menu-Version"],
 )
 
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI rather than @app.middleware("http"): that one finishes as soon
+    as the response headers are ready, so a streamed body (e.g. the NDJSON
+    export) would be timed to its first byte and its getMores never counted.
+    Here the request is observed once the last body chunk has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_metrics = RequestMetrics()
+        token = current_request_metrics.set(request_metrics)
+        started = time.perf_counter()
+        status = 500
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            elapsed = time.perf_counter() - started
+            # Label by route template so ids in the path don't explode cardinality
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, str(status)).observe(elapsed)
+            HTTP_REQUEST_MONGO_COMMANDS.labels(scope["method"], path).observe(len(request_metrics.commands))
+            for command, collection, seconds, ok in request_metrics.commands:
+                observe_mongo_command(path, command, collection, seconds, ok)
+
+        async def send_observed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                observe()
+
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            current_request_metrics.reset(token)
+            if not observed:
+                # The app raised or the client went away before the body was complete
+                observe()
+
+app.add_middleware(RequestMetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -377,6 +3080,37 @@ logger = logging.getLogger(__name__)
 @app.get("/")
 async def root():
     return {"message": "Backend online"}
-@app.on_event("shutdown")
-async def shutdown_db_client():
+# Lifecycle
+async def warm_up_mongo():
+    """Fails startup fast if Mongo is unreachable, then opens the warm-up connections."""
+    started = time.perf_counter()
+    await client.admin.command("ping")
+    # Concurrent pings each check out their own connection
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(MONGO_WARMUP_CONNECTIONS)))
+    logger.info(f"MongoDB ready in {(time.perf_counter() - started) * 1000:.0f} ms: {pool_stats.snapshot()}")
+
+async def startup(app: FastAPI):
+    app.state.ready = False
+    await warm_up_mongo()
+    await ensure_indexes(db)
+    await manager.bus.start(manager)
+    await menu_index.load(db)
+    await dashboard_stats.load(db)
+    app.state.stats_reconciler = asyncio.create_task(dashboard_stats.reconcile_forever(db))
+    await order_log.load()
+    await table_occupancy.load(db, order_log.projection)
+    app.state.order_log_follower = asyncio.create_task(order_log.run_forever())
+    app.state.ws_reaper = asyncio.create_task(manager.reap_forever())
+    if order_intake is not None:
+        await order_intake.start()
+    app.state.ready = True
+
+async def shutdown(app: FastAPI):
+    app.state.ready = False
+    if order_intake is not None:
+        await order_intake.stop()
+    app.state.ws_reaper.cancel()
+    app.state.order_log_follower.cancel()
+    app.state.stats_reconciler.cancel()
+    await manager.bus.stop(manager)
     client.close()
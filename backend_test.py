@@ -331,14 +331,16 @@ class CafeteriaBackendTester:
                 except asyncio.TimeoutError:
                     pass  # No initial message, that's fine
                 
-                # Send a test message
-                test_message = "Test message from backend tester"
-                await websocket.send(test_message)
+                # Subscribe to the kitchen feed
+                await websocket.send(json.dumps({"action": "subscribe", "topics": ["orders"]}))
                 
-                # Wait for response
-                response = await asyncio.wait_for(websocket.recv(), timeout=5.0)
+                # Wait for the acknowledgement, skipping the hello frame and heartbeat pings
+                while True:
+                    response = json.loads(await asyncio.wait_for(websocket.recv(), timeout=5.0))
+                    if response.get("type") not in ("hello", "ping"):
+                        break
                 
-                if "Message received" in response:
+                if response.get("type") == "subscriptions" and "orders" in response.get("topics", []):
                     self.log_test("WebSocket Connection", True, f"Received: {response}")
                     return True
                 else:
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: columnar analytics report
+Builds a month of synthetic orders (about a million line items) the way
+load_orders_frame/load_lines_frame do, from batches of records, then times
+the vectorized report. Mongo is left out; this measures the in-process part.
+"""
+
+import asyncio
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import (
+    LINE_COLUMNS, ORDER_COLUMNS, _categorize, analytics_report, frame_from_cursor,
+)
+
+ORDERS = 250_000
+MENU = [(str(uuid.uuid4()), f"Item {i}", round(random.uniform(3, 15), 2)) for i in range(40)]
+WAITERS = [f"Waiter {i}" for i in range(12)]
+STATUSES = ["delivered"] * 8 + ["cancelled", "pending"]
+
+
+class ListCursor:
+    """Hands out pre-built documents with the Motor to_list(length) contract."""
+
+    def __init__(self, documents: List[dict]):
+        self.documents = documents
+        self.position = 0
+
+    async def to_list(self, length: int) -> List[dict]:
+        batch = self.documents[self.position:self.position + length]
+        self.position += length
+        return batch
+
+
+def make_documents():
+    rng = random.Random(7)
+    start = datetime.utcnow() - timedelta(days=30)
+    orders, lines = [], []
+    for i in range(ORDERS):
+        created = start + timedelta(seconds=i * 30 * 86400 / ORDERS)
+        status = rng.choice(STATUSES)
+        order_id = str(uuid.uuid4())
+        total = 0.0
+        for item_id, name, price in rng.sample(MENU, 4):
+            quantity = rng.randint(1, 3)
+            total += price * quantity
+            lines.append({
+                "order_id": order_id, "status": status, "created_at": created,
+                "menu_item_id": item_id, "menu_item_name": name, "quantity": quantity, "price": price,
+            })
+        orders.append({
+            "id": order_id, "table_number": rng.randint(1, 30), "waiter_name": rng.choice(WAITERS),
+            "status": status, "total_amount": round(total, 2), "created_at": created,
+            "updated_at": created + timedelta(minutes=rng.uniform(5, 60)),
+        })
+    return orders, lines
+
+
+async def build_frames(orders: List[dict], lines: List[dict]):
+    orders_frame = await frame_from_cursor(ListCursor(orders), ORDER_COLUMNS)
+    lines_frame = await frame_from_cursor(ListCursor(lines), LINE_COLUMNS)
+    return (
+        _categorize(orders_frame, ["waiter_name", "status"]),
+        _categorize(lines_frame, ["status", "menu_item_id", "menu_item_name"]),
+    )
+
+
+def main():
+    orders, lines = make_documents()
+    print(f"{len(orders)} orders, {len(lines)} line items")
+
+    started = time.perf_counter()
+    orders_frame, lines_frame = asyncio.run(build_frames(orders, lines))
+    print(f"  batches -> DataFrames   {time.perf_counter() - started:>8.2f} s")
+
+    started = time.perf_counter()
+    report = analytics_report(orders_frame, lines_frame, 10)
+    print(f"  vectorized report       {time.perf_counter() - started:>8.2f} s")
+    print(f"  top item: {report['top_items'][0]['name']} ({report['top_items'][0]['quantity']} sold)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: broadcast payload encoding
+Compares the old per-broadcast json.dumps(..., default=str) path, re-encoded
+for every socket, with the shared Event buffer used by ConnectionManager.
+"""
+
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import json
+from server import Event, Order, OrderItem, orjson
+
+SUBSCRIBERS = [1, 10, 50]
+ROUNDS = 2000
+
+
+def make_order() -> Order:
+    items = [
+        OrderItem(menu_item_id=f"item-{i}", menu_item_name=f"Cappuccino {i}", quantity=2, price=5.0)
+        for i in range(6)
+    ]
+    return Order(table_number=7, items=items, total_amount=60.0, waiter_name="Ana", special_requests="Sem açúcar")
+
+
+def legacy_path(order: Order, subscribers: int):
+    message = json.dumps({
+        "type": "new_order",
+        "order": order.dict(),
+        "timestamp": datetime.utcnow().isoformat()
+    }, default=str)
+    for _ in range(subscribers):
+        message.encode("utf-8")
+
+
+def shared_event_path(order: Order, subscribers: int):
+    event = Event({
+        "type": "new_order",
+        "order": order.dict(),
+        "timestamp": datetime.utcnow()
+    })
+    for _ in range(subscribers):
+        event.text
+
+
+def main():
+    order = make_order()
+    print(f"Encoder: {'orjson' if orjson is not None else 'stdlib json'}")
+    print(f"{'subscribers':>12} {'legacy µs':>12} {'shared µs':>12} {'speedup':>8}")
+    for subscribers in SUBSCRIBERS:
+        legacy = timeit.timeit(lambda: legacy_path(order, subscribers), number=ROUNDS) / ROUNDS
+        shared = timeit.timeit(lambda: shared_event_path(order, subscribers), number=ROUNDS) / ROUNDS
+        print(f"{subscribers:>12} {legacy * 1e6:>12.1f} {shared * 1e6:>12.1f} {legacy / shared:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Index benchmark
+Seeds a scratch database with 100k orders, times the hot queries from
+server.py without indexes, then again after ensure_indexes().
+
+Requires a local mongod reachable through MONGO_URL (backend/.env).
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import ACTIVE_ORDER_STATUSES, OrderStatus, client, ensure_indexes, today_start_utc
+
+ORDERS = 100_000
+TABLES = 40
+REPEAT = 20
+BENCH_DB = f"{os.environ['DB_NAME']}_index_bench"
+
+
+def make_order(now: datetime, index: int) -> dict:
+    # Mostly finished history with a few dozen active orders, like a real day
+    status = random.choice(ACTIVE_ORDER_STATUSES) if index % 2000 == 0 else random.choice(
+        [OrderStatus.DELIVERED] * 9 + [OrderStatus.CANCELLED]
+    )
+    created_at = now - timedelta(minutes=random.randint(0, 60 * 24 * 90))
+    return {
+        "id": str(uuid.uuid4()),
+        "table_number": random.randint(1, TABLES),
+        "items": [{"menu_item_id": "x", "menu_item_name": "Cappuccino", "quantity": 1, "price": 5.0}],
+        "status": status,
+        "total_amount": 5.0,
+        "waiter_name": "Bench",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "sync_seq": index,
+    }
+
+
+async def seed(database):
+    now = datetime.utcnow()
+    await database.orders.drop()
+    await database.tables.drop()
+    batch = []
+    for index in range(ORDERS):
+        batch.append(make_order(now, index))
+        if len(batch) == 5000:
+            await database.orders.insert_many(batch)
+            batch = []
+    if batch:
+        await database.orders.insert_many(batch)
+    await database.tables.insert_many([
+        {"id": str(uuid.uuid4()), "number": n, "status": "available", "capacity": 4} for n in range(1, TABLES + 1)
+    ])
+
+
+async def timed(label: str, make_coro) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        await make_coro()
+    elapsed = (time.perf_counter() - started) / REPEAT * 1000
+    print(f"  {label:<28} {elapsed:>9.2f} ms")
+    return elapsed
+
+
+async def run_queries(database, order_id: str) -> dict:
+    revenue_pipeline = [
+        {"$match": {"created_at": {"$gte": today_start_utc()}, "status": {"$in": [OrderStatus.DELIVERED]}}},
+        {"$group": {"_id": None, "total": {"$sum": "$total_amount"}}},
+    ]
+    return {
+        "active orders": await timed("active orders", lambda: database.orders.find(
+            {"status": {"$in": ACTIVE_ORDER_STATUSES}}).sort("created_at", 1).to_list(1000)),
+        "order by id": await timed("update order by id", lambda: database.orders.update_one(
+            {"id": order_id}, {"$set": {"updated_at": datetime.utcnow()}})),
+        "revenue today": await timed("revenue today", lambda: database.orders.aggregate(revenue_pipeline).to_list(1)),
+        "recent orders": await timed("latest 50 orders", lambda: database.orders.find().sort(
+            "created_at", -1).to_list(50)),
+        "table by number": await timed("update table by number", lambda: database.tables.update_one(
+            {"number": TABLES // 2}, {"$set": {"status": "occupied"}})),
+    }
+
+
+async def main():
+    database = client[BENCH_DB]
+    print(f"Seeding {ORDERS} orders into {BENCH_DB}...")
+    await seed(database)
+    order_id = (await database.orders.find_one({}, skip=ORDERS // 2))["id"]
+
+    print("Without indexes:")
+    before = await run_queries(database, order_id)
+    await ensure_indexes(database)
+    print("With indexes:")
+    after = await run_queries(database, order_id)
+
+    print("Speedup:")
+    for label in before:
+        print(f"  {label:<28} {before[label] / after[label]:>8.1f}x")
+    await client.drop_database(BENCH_DB)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark: order intake under bursts
+Fires POST /api/orders open-loop at a fixed rate (500 orders/s by default,
+regardless of how fast responses come back) and reports create latency for
+the direct path and for ORDER_INTAKE_MODE=write_behind. mongomock inserts
+run on the event loop and slow down as collections grow, so local numbers
+only compare the two modes; point --url at a backend on a real mongod for
+absolute figures.
+
+    # both modes, each on a fresh mongomock backend
+    python benchmarks/intake_bench.py
+    # a backend you started yourself (set its ORDER_INTAKE_MODE before starting it)
+    python benchmarks/intake_bench.py --url http://localhost:8001
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+from loadgen import distribution, free_port, start_local_backend
+
+CONNECTIONS = 64
+
+
+async def burst(url: str, rate: int, seconds: float) -> dict:
+    # Requests beyond the pool wait for a connection; that wait counts as latency
+    limits = httpx.Limits(max_connections=CONNECTIONS, max_keepalive_connections=CONNECTIONS)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limits) as client:
+        await client.post("/api/init-data")
+        menu = (await client.get("/api/menu")).json()
+        tables = (await client.get("/api/tables")).json()
+        latencies: List[float] = []
+        errors = 0
+
+        async def create(i: int):
+            nonlocal errors
+            item = menu[i % len(menu)]
+            started = time.perf_counter()
+            try:
+                response = await client.post("/api/orders", json={
+                    "table_number": tables[i % len(tables)]["number"],
+                    "waiter_name": f"Waiter {i % 8}",
+                    "items": [{
+                        "menu_item_id": item["id"],
+                        "menu_item_name": item["name"],
+                        "quantity": 1,
+                        "price": item["price"],
+                    }],
+                })
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+        total = int(rate * seconds)
+        started = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            # Open loop: request i leaves at i / rate, whether or not earlier ones returned
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(create(i)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    report = distribution(latencies)
+    report["errors"] = errors
+    report["achieved_rps"] = round(total / elapsed, 1)
+    return report
+
+
+def run_mode(mode: Optional[str], url: Optional[str], rate: int, seconds: float) -> dict:
+    if url:
+        return asyncio.run(burst(url, rate, seconds))
+    port = free_port()
+    with tempfile.TemporaryDirectory() as journal_dir:
+        backend = start_local_backend(
+            port,
+            ORDER_INTAKE_MODE=mode,
+            ORDER_JOURNAL_PATH=str(Path(journal_dir) / "bench.journal"),
+        )
+        try:
+            return asyncio.run(burst(f"http://127.0.0.1:{port}", rate, seconds))
+        finally:
+            backend.terminate()
+            backend.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark this running backend instead of local ones")
+    parser.add_argument("--rate", type=int, default=500, help="orders per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    modes = [None] if args.url else ["direct", "write_behind"]
+    print(f"POST /api/orders at {args.rate}/s for {args.seconds:.0f}s")
+    print(f"  {'mode':14} {'count':>6} {'err':>4} {'req/s':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for mode in modes:
+        report = run_mode(mode, args.url, args.rate, args.seconds)
+        print(f"  {mode or args.url:14} {report['count']:6d} {report['errors']:4d} {report['achieved_rps']:7.1f} "
+              f"{report['p50_ms']:7.2f}ms {report['p90_ms']:7.2f}ms {report['p99_ms']:7.2f}ms {report['max_ms']:7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Load generator and performance regression check
+Simulates waiters placing and advancing orders, kitchen screens listening on
+/ws and manager dashboards polling /api/sync, then reports per-endpoint
+latency percentiles, throughput and broadcast lag (order created_at to
+receipt on a kitchen socket).
+
+Against a running backend:
+    python benchmarks/loadgen.py --url http://localhost:8001 --output run.json
+
+Self-contained, with the backend started on an in-memory mongomock stand-in
+(benchmarks/mongomock_backend.py; pip install -r benchmarks/requirements.txt):
+    python benchmarks/loadgen.py --mongomock --output run.json
+
+CI keeps a baseline JSON from a known-good run and diffs every new run
+against it; the exit code is 1 when p99 latency or throughput regresses by
+more than --tolerance:
+    python benchmarks/loadgen.py --mongomock --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+STATUS_FLOW = ["preparing", "ready", "delivered"]
+
+
+class Recorder:
+    """Collects request latencies and failures per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    async def timed(self, name: str, request) -> Optional[Any]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            response = None
+        self.latencies[name].append(time.perf_counter() - started)
+        if response is None or response.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        return response.json()
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def distribution(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p90_ms": round(percentile(ordered, 90) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+async def waiter(client: httpx.AsyncClient, recorder: Recorder, menu: List[dict], tables: List[dict],
+                 name: str, stop_at: float, advance: float, think: float, rng: random.Random):
+    while time.monotonic() < stop_at:
+        picks = rng.sample(menu, k=min(len(menu), rng.randint(1, 3)))
+        order = await recorder.timed("POST /api/orders", client.post("/api/orders", json={
+            "table_number": rng.choice(tables)["number"],
+            "waiter_name": name,
+            "items": [{
+                "menu_item_id": item["id"],
+                "menu_item_name": item["name"],
+                "quantity": rng.randint(1, 2),
+                "price": item["price"],
+            } for item in picks],
+        }))
+        if order and rng.random() < advance:
+            for status in STATUS_FLOW:
+                await recorder.timed(
+                    "PUT /api/orders/{id}/status",
+                    client.put(f"/api/orders/{order['id']}/status", json={"status": status}),
+                )
+        await asyncio.sleep(think)
+
+
+async def kitchen_screen(ws_url: str, lags: List[float], received: Counter, ready: asyncio.Event, done: asyncio.Event):
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        await ws.send(json.dumps({"action": "subscribe", "topics": ["orders"]}))
+        ready.set()
+        while not done.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.25)
+            except asyncio.TimeoutError:
+                continue
+            now = datetime.utcnow()
+            message = json.loads(raw)
+            received[message.get("type", "unknown")] += 1
+            if message.get("type") == "ping":
+                await ws.send(json.dumps({"action": "pong"}))
+                continue
+            if message.get("type") == "new_order":
+                orders = [message["order"]]
+            elif message.get("type") == "new_orders":
+                orders = message["orders"]
+            else:
+                continue
+            for order in orders:
+                created = datetime.fromisoformat(order["created_at"]).replace(tzinfo=None)
+                lags.append((now - created).total_seconds())
+
+
+async def dashboard(client: httpx.AsyncClient, recorder: Recorder, stop_at: float, interval: float):
+    cursor = None
+    while time.monotonic() < stop_at:
+        params = {"since": cursor} if cursor else {}
+        page = await recorder.timed("GET /api/sync", client.get("/api/sync", params=params))
+        if page:
+            cursor = page.get("cursor", cursor)
+        await recorder.timed("GET /api/dashboard/stats", client.get("/api/dashboard/stats"))
+        await recorder.timed("GET /api/orders/active", client.get("/api/orders/active"))
+        await asyncio.sleep(interval)
+
+
+async def run_load(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    lags: List[float] = []
+    received: Counter = Counter()
+    ws_url = args.url.replace("http", "ws", 1).rstrip("/") + "/ws"
+    limits = httpx.Limits(max_connections=args.waiters + args.dashboards + 4)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=30, limits=limits) as client:
+        await client.post("/api/init-data")
+        menu = (await client.get("/api/menu")).json()
+        tables = (await client.get("/api/tables")).json()
+        if not menu or not tables:
+            raise SystemExit("Backend returned no menu or tables after /api/init-data")
+
+        done = asyncio.Event()
+        screens_ready = [asyncio.Event() for _ in range(args.screens)]
+        screens = [
+            asyncio.create_task(kitchen_screen(ws_url, lags, received, ready, done))
+            for ready in screens_ready
+        ]
+        await asyncio.wait_for(asyncio.gather(*(ready.wait() for ready in screens_ready)), timeout=10)
+
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(
+            *(waiter(client, recorder, menu, tables, f"Waiter {i + 1}", stop_at, args.advance, args.think, rng)
+              for i in range(args.waiters)),
+            *(dashboard(client, recorder, stop_at, args.poll_interval) for _ in range(args.dashboards)),
+        )
+        elapsed = time.monotonic() - started
+        # Let in-flight broadcasts land before closing the screens
+        await asyncio.sleep(0.5)
+        done.set()
+        await asyncio.gather(*screens, return_exceptions=True)
+
+    endpoints = {}
+    for name, samples in sorted(recorder.latencies.items()):
+        stats = distribution(samples)
+        stats["errors"] = recorder.errors[name]
+        stats["rps"] = round(len(samples) / elapsed, 2)
+        endpoints[name] = stats
+    broadcast = distribution(lags)
+    broadcast["messages"] = dict(sorted(received.items()))
+    return {
+        "config": {
+            "waiters": args.waiters,
+            "screens": args.screens,
+            "dashboards": args.dashboards,
+            "duration_s": args.duration,
+            "think_s": args.think,
+            "poll_interval_s": args.poll_interval,
+            "advance": args.advance,
+            "seed": args.seed,
+            "target": "mongomock" if args.mongomock else args.url,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "endpoints": endpoints,
+        "broadcast_lag": broadcast,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for name, base in baseline.get("endpoints", {}).items():
+        now = current["endpoints"].get(name)
+        if now is None:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        if base["p99_ms"] and now["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {now['p99_ms']}ms vs baseline {base['p99_ms']}ms")
+        if base["rps"] and now["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {now['rps']} req/s vs baseline {base['rps']} req/s")
+        if now["errors"] > base["errors"]:
+            regressions.append(f"{name}: {now['errors']} errors vs baseline {base['errors']}")
+    base_lag = baseline.get("broadcast_lag", {}).get("p99_ms")
+    now_lag = current["broadcast_lag"]["p99_ms"]
+    if base_lag and now_lag > base_lag * (1 + tolerance):
+        regressions.append(f"broadcast lag: p99 {now_lag}ms vs baseline {base_lag}ms")
+    return regressions
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_backend(port: int, **settings: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DB_NAME=os.environ.get("DB_NAME", "loadgen"),
+        **settings,
+    )
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve().parent / "mongomock_backend.py"), "--port", str(port)],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Backend exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/menu", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Backend did not start within 20s")
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{'endpoint':32} {'count':>7} {'err':>5} {'req/s':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:32} {stats['count']:7d} {stats['errors']:5d} {stats['rps']:9.1f} "
+              f"{stats['p50_ms']:7.2f}ms {stats['p90_ms']:7.2f}ms {stats['p99_ms']:7.2f}ms {stats['max_ms']:7.2f}ms")
+    lag = report["broadcast_lag"]
+    print(f"{'broadcast lag (new orders)':32} {lag['count']:7d} {'':5} {'':9} "
+          f"{lag['p50_ms']:7.2f}ms {lag['p90_ms']:7.2f}ms {lag['p99_ms']:7.2f}ms {lag['max_ms']:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running backend")
+    target.add_argument("--mongomock", action="store_true", help="start a local backend on a mongomock stand-in")
+    parser.add_argument("--waiters", type=int, default=20)
+    parser.add_argument("--screens", type=int, default=5, help="kitchen WebSocket screens")
+    parser.add_argument("--dashboards", type=int, default=3, help="polling manager dashboards")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load")
+    parser.add_argument("--think", type=float, default=0.05, help="waiter pause between orders (s)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="dashboard poll interval (s)")
+    parser.add_argument("--advance", type=float, default=0.5, help="share of orders walked to delivered")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="compare against this JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio")
+    args = parser.parse_args()
+
+    backend = None
+    if args.mongomock:
+        port = free_port()
+        backend = start_local_backend(port)
+        args.url = f"http://127.0.0.1:{port}"
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Serves backend/server.py on an in-memory mongomock database, for the load
+generator and benchmarks on machines without a mongod. Needs the packages in
+benchmarks/requirements.txt; the backend itself never imports mongomock.
+
+    python benchmarks/mongomock_backend.py --port 8001
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+# server.py builds its Motor client at import; it is replaced before serving
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "loadgen")
+
+import uvicorn
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ASCENDING, IndexModel
+
+import server
+
+
+def use_mongomock():
+    server.client.close()
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[os.environ["DB_NAME"]]
+    server.order_log.database = server.db
+    # mongomock ignores partialFilterExpression, so the partial unique index
+    # would make every order without a key collide; sparse is equivalent here
+    server.INDEXES["orders"] = [
+        IndexModel([("idempotency_key", ASCENDING)], name=index.document["name"], unique=True, sparse=True)
+        if index.document["name"] == "idempotency_key_unique" else index
+        for index in server.INDEXES["orders"]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+    use_mongomock()
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: list endpoint response path
+Compares the previous path for 1000 orders (Order(**doc) per document, then
+FastAPI's response_model validation and JSON encoding) with the projected
+documents serialized straight to bytes by FastJSONResponse.
+"""
+
+import json
+import sys
+import timeit
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from pydantic import TypeAdapter
+from server import FastJSONResponse, Order, with_model_defaults
+
+ORDERS = 1000
+ROUNDS = 50
+
+
+def make_documents() -> List[dict]:
+    now = datetime.utcnow()
+    return [{
+        "id": str(uuid.uuid4()),
+        "table_number": i % 20 + 1,
+        "items": [
+            {"menu_item_id": str(uuid.uuid4()), "menu_item_name": "Cappuccino", "quantity": 2, "price": 5.0, "special_requests": None}
+            for _ in range(4)
+        ],
+        "status": "pending",
+        "total_amount": 40.0,
+        "waiter_name": "Ana",
+        "created_at": now,
+        "updated_at": now,
+        "special_requests": None,
+    } for i in range(ORDERS)]
+
+
+adapter = TypeAdapter(List[Order])
+
+
+def legacy_path(documents: List[dict]) -> bytes:
+    models = [Order(**document) for document in documents]
+    # What FastAPI does with response_model=List[Order]
+    validated = adapter.validate_python(models)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(documents: List[dict]) -> bytes:
+    return FastJSONResponse(with_model_defaults(Order, documents)).body
+
+
+def main():
+    documents = make_documents()
+    legacy = timeit.timeit(lambda: legacy_path(documents), number=ROUNDS) / ROUNDS
+    fast = timeit.timeit(lambda: fast_path(documents), number=ROUNDS) / ROUNDS
+    print(f"{ORDERS} orders per response")
+    print(f"  model + response_model  {legacy * 1000:>8.2f} ms")
+    print(f"  projected fast path     {fast * 1000:>8.2f} ms")
+    print(f"  speedup                 {legacy / fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
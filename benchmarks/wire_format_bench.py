@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: WebSocket wire formats
+Sizes and encode throughput of a rush of new_order events in the original
+json.dumps payloads, the current JSON frames, and the opt-in compact formats
+(short-key JSON and MessagePack). Also sizes after permessage-deflate, with
+and without context takeover, for the bytes a room full of tablets receives.
+"""
+
+import json
+import random
+import sys
+import timeit
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import Event, msgpack
+
+EVENTS = 1000
+TABLETS = 40
+ROUNDS = 5
+
+MENU = [(str(uuid.uuid4()), name, price) for name, price in [
+    ("Café Expresso", 3.5), ("Cappuccino", 5.0), ("Latte", 5.5), ("Mocha", 6.0),
+    ("Pão na Chapa", 4.5), ("Sanduíche Natural", 8.0), ("Croissant", 5.5), ("Pudim", 5.0),
+]]
+
+
+def make_payloads() -> List[dict]:
+    rng = random.Random(3)
+    now = datetime.utcnow()
+    payloads = []
+    for i in range(EVENTS):
+        created = now + timedelta(seconds=i)
+        items = [{
+            "menu_item_id": item_id,
+            "menu_item_name": name,
+            "quantity": rng.randint(1, 3),
+            "price": price,
+            "special_requests": rng.choice([None, None, None, "sem açúcar"]),
+        } for item_id, name, price in rng.sample(MENU, rng.randint(1, 4))]
+        payloads.append({
+            "type": "new_order",
+            "order": {
+                "id": str(uuid.uuid4()),
+                "table_number": rng.randint(1, 20),
+                "items": items,
+                "status": "pending",
+                "total_amount": sum(item["price"] * item["quantity"] for item in items),
+                "waiter_name": rng.choice(["Ana", "Bruno", "Carla"]),
+                "created_at": created,
+                "updated_at": created,
+                "special_requests": None,
+                "version": 1,
+            },
+            "timestamp": created,
+        })
+    return payloads
+
+
+def encoders() -> Dict[str, Callable[[dict], bytes]]:
+    formats = {
+        # What broadcast() sent before events were encoded once per event
+        "json.dumps (original)": lambda payload: json.dumps(payload, default=str).encode("utf-8"),
+        "json frames (current)": lambda payload: Event(payload).data,
+        "compact json": lambda payload: Event(payload).encoded("compact"),
+    }
+    if msgpack is not None:
+        formats["msgpack"] = lambda payload: Event(payload).encoded("msgpack")
+    return formats
+
+
+def deflated(frames: List[bytes], takeover: bool) -> int:
+    # permessage-deflate: raw deflate, each message flushed on its own
+    total = 0
+    compressor = zlib.compressobj(wbits=-15)
+    for frame in frames:
+        if not takeover:
+            compressor = zlib.compressobj(wbits=-15)
+        total += len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def main():
+    payloads = make_payloads()
+    print(f"{EVENTS} new_order events, sizes per event and for {TABLETS} tablets")
+    print(f"  {'format':24} {'avg B':>7} {'deflate':>8} {'+ctx':>7} {'rush MB':>8} {'enc/s':>9}")
+    baseline = None
+    for name, encode in encoders().items():
+        frames = [encode(payload) for payload in payloads]
+        raw = sum(len(frame) for frame in frames)
+        seconds = timeit.timeit(lambda: [encode(payload) for payload in payloads], number=ROUNDS) / ROUNDS
+        with_takeover = deflated(frames, takeover=True)
+        baseline = baseline or raw
+        print(
+            f"  {name:24} {raw / EVENTS:7.0f} {deflated(frames, takeover=False) / EVENTS:8.0f} "
+            f"{with_takeover / EVENTS:7.0f} {with_takeover * TABLETS / 1e6:8.2f} {EVENTS / seconds:9.0f}"
+            f"   ({raw / baseline:.0%} of original raw)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,100 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 const WS_URL = BACKEND_URL.replace('https://', 'wss://').replace('http://', 'ws://');
 
+const ACTIVE_STATUSES = ['pending', 'preparing', 'ready'];
+
+// Merge a delta into a list of records keyed by id
+const mergeById = (current, changes, full) => {
+  const byId = new Map(full ? [] : current.map(record => [record.id, record]));
+  changes.forEach(record => byId.set(record.id, record));
+  return [...byId.values()];
+};
+
+// Offline order queue: orders that could not reach the server are kept in
+// localStorage and flushed through /orders/batch. Each carries an
+// idempotency key, so replaying a batch after a reconnect is safe.
+const OFFLINE_QUEUE_KEY = 'pendingOrders';
+const ORDER_BATCH_MAX = 100;
+
+const loadOfflineQueue = () => JSON.parse(localStorage.getItem(OFFLINE_QUEUE_KEY) || '[]');
+const saveOfflineQueue = (orders) => localStorage.setItem(OFFLINE_QUEUE_KEY, JSON.stringify(orders));
+
+// crypto.randomUUID only exists in secure contexts; a tablet on a plain-http
+// LAN origin still has getRandomValues, so build a v4 UUID from that.
+const newIdempotencyKey = () => {
+  if (window.crypto.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+};
+
+// Returns the orders still queued and the ones the server refused (e.g. an
+// item became unavailable), with their errors; retrying those cannot succeed.
+const flushOfflineQueue = async () => {
+  const queued = loadOfflineQueue().slice(0, ORDER_BATCH_MAX);
+  if (queued.length === 0) return { remaining: 0, rejected: [] };
+  const response = await axios.post(`${API}/orders/batch`, { orders: queued });
+  const byKey = new Map(queued.map(order => [order.idempotency_key, order]));
+  const rejected = response.data.rejected.map(rejection => ({
+    order: byKey.get(rejection.idempotency_key),
+    errors: rejection.errors
+  }));
+  const remaining = loadOfflineQueue().filter(order => !byKey.has(order.idempotency_key));
+  saveOfflineQueue(remaining);
+  return { remaining: remaining.length, rejected };
+};
+
 // Mobile Detection
 const isMobile = () => window.innerWidth <= 768;
 
+// Compact wire format (/ws?encoding=compact): binary frames of short-key JSON.
+// Mirrors COMPACT_KEYS in backend/server.py (also served at /api/ws/formats).
+const COMPACT_KEYS = {
+  t: 'type', s: 'seq', sm: 'stream', rs: 'resumed', rp: 'replayed',
+  o: 'order', os: 'orders', oi: 'order_id', i: 'id', n: 'table_number',
+  w: 'waiter_name', st: 'status', it: 'items', a: 'total_amount',
+  c: 'created_at', u: 'updated_at', ts: 'timestamp', r: 'special_requests',
+  v: 'version', d: 'detail', tp: 'topics', e: 'encoding',
+};
+const textDecoder = new TextDecoder();
+
+const expandCompact = (value) => {
+  if (Array.isArray(value)) return value.map(expandCompact);
+  if (value === null || typeof value !== 'object') return value;
+  const expanded = {};
+  Object.entries(value).forEach(([key, inner]) => {
+    const name = COMPACT_KEYS[key] || key;
+    // Items stay as [menu_item_id, quantity, special_requests?]
+    expanded[name] = name === 'items' ? inner : expandCompact(inner);
+  });
+  return expanded;
+};
+
+const decodeFrame = (frame) => (
+  typeof frame === 'string'
+    ? JSON.parse(frame)
+    : expandCompact(JSON.parse(textDecoder.decode(frame)))
+);
+
 // WebSocket Hook
 const useWebSocket = (onMessage) => {
   const ws = useRef(null);
   const [isConnected, setIsConnected] = useState(false);
+  // Last broadcast seq seen and the server stream it belongs to, for resume
+  const lastSeq = useRef(null);
+  const stream = useRef(null);
 
   useEffect(() => {
     const connect = () => {
-      ws.current = new WebSocket(`${WS_URL}/ws`);
+      const resume = lastSeq.current !== null
+        ? `&resume_from=${lastSeq.current}&stream=${stream.current}`
+        : '';
+      ws.current = new WebSocket(`${WS_URL}/ws?encoding=compact${resume}`);
+      ws.current.binaryType = 'arraybuffer';
       
       ws.current.onopen = () => {
         setIsConnected(true);
@@ -25,7 +108,31 @@ const useWebSocket = (onMessage) => {
       
       ws.current.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
+          const data = decodeFrame(event.data);
+          if (data.type === 'ping') {
+            ws.current.send(JSON.stringify({ action: 'pong' }));
+            return;
+          }
+          if (data.type === 'hello') {
+            stream.current = data.stream;
+            if (!data.resumed) {
+              lastSeq.current = data.seq;
+            }
+            return;
+          }
+          if (data.type === 'resync') {
+            // Missed events are gone from the server buffer: refetch everything
+            lastSeq.current = data.seq;
+            onMessage(data);
+            return;
+          }
+          if (typeof data.seq === 'number') {
+            if (lastSeq.current !== null && data.seq > lastSeq.current + 1) {
+              // Frames were coalesced away on the server; treat it as a resync
+              onMessage({ type: 'resync', seq: data.seq });
+            }
+            lastSeq.current = data.seq;
+          }
           onMessage(data);
         } catch (e) {
           console.log('Received:', event.data);
@@ -66,6 +173,7 @@ const WaiterInterface = ({ onOrderCreated }) => {
   const [selectedCategory, setSelectedCategory] = useState('all');
   const [specialRequests, setSpecialRequests] = useState('');
   const [isSubmitting, setIsSubmitting] = useState(false);
+  const [queuedOrders, setQueuedOrders] = useState(loadOfflineQueue().length);
 
   useEffect(() => {
     fetchMenu();
@@ -73,6 +181,37 @@ const WaiterInterface = ({ onOrderCreated }) => {
     fetchCategories();
   }, []);
 
+  useEffect(() => {
+    const flush = async () => {
+      try {
+        let result = await flushOfflineQueue();
+        const rejected = [...result.rejected];
+        while (result.remaining > 0) {
+          result = await flushOfflineQueue();
+          rejected.push(...result.rejected);
+        }
+        setQueuedOrders(0);
+        if (rejected.length > 0) {
+          alert(rejected.map(({ order, errors }) =>
+            `Pedido da mesa ${order.table_number} recusado: ${errors.join(', ')}`
+          ).join('\n'));
+          fetchMenu();
+        }
+      } catch (error) {
+        setQueuedOrders(loadOfflineQueue().length);
+      }
+    };
+    flush();
+    window.addEventListener('online', flush);
+    const interval = setInterval(() => {
+      if (loadOfflineQueue().length > 0) flush();
+    }, 15000);
+    return () => {
+      window.removeEventListener('online', flush);
+      clearInterval(interval);
+    };
+  }, []);
+
   const fetchMenu = async () => {
     try {
       const response = await axios.get(`${API}/menu`);
@@ -138,27 +277,45 @@ const WaiterInterface = ({ onOrderCreated }) => {
     }
 
     setIsSubmitting(true);
+    let orderData = null;
+    const clearForm = () => {
+      setCart([]);
+      setSelectedTable(null);
+      setSpecialRequests('');
+    };
+
     try {
-      const orderData = {
+      orderData = {
         table_number: selectedTable.number,
-        items: cart,
+        // Names and prices come from the menu on the server
+        items: cart.map(({ menu_item_id, quantity }) => ({ menu_item_id, quantity })),
         waiter_name: waiterName,
-        special_requests: specialRequests || null
+        special_requests: specialRequests || null,
+        idempotency_key: newIdempotencyKey()
       };
-
-      await axios.post(`${API}/orders`, orderData);
-      
-      // Clear form
-      setCart([]);
-      setSelectedTable(null);
-      setSpecialRequests('');
+      const response = await axios.post(`${API}/orders/batch`, { orders: [orderData] });
+      if (response.data.rejected.length > 0) {
+        alert(`Pedido recusado: ${response.data.rejected[0].errors.join(', ')}`);
+        fetchMenu();
+        setIsSubmitting(false);
+        return;
+      }
+      clearForm();
       
       alert('Pedido enviado com sucesso!');
       onOrderCreated && onOrderCreated();
       fetchTables(); // Refresh tables to update status
     } catch (error) {
       console.error('Error creating order:', error);
-      alert('Erro ao enviar pedido. Tente novamente.');
+      if (!error.response && orderData) {
+        // No connection: keep the order and send it when we are back online
+        saveOfflineQueue([...loadOfflineQueue(), orderData]);
+        setQueuedOrders(loadOfflineQueue().length);
+        clearForm();
+        alert('Sem conexão. O pedido foi salvo e será enviado automaticamente.');
+      } else {
+        alert('Erro ao enviar pedido. Tente novamente.');
+      }
     }
     setIsSubmitting(false);
   };
@@ -178,6 +335,11 @@ const WaiterInterface = ({ onOrderCreated }) => {
       {/* Header */}
       <div className="bg-amber-600 text-white p-4 sticky top-0 z-10">
         <h1 className="text-xl font-bold">🧑‍🍳 Interface do Garçom</h1>
+        {queuedOrders > 0 && (
+          <div className="mt-1 text-xs bg-amber-800 rounded px-2 py-1 inline-block">
+            {queuedOrders} pedido(s) aguardando conexão
+          </div>
+        )}
         <div className="mt-2 flex gap-2">
           <input
             type="text"
@@ -306,32 +468,54 @@ const WaiterInterface = ({ onOrderCreated }) => {
 };
 
 // Manager Interface (Desktop)
-const ManagerInterface = () => {
+const ManagerInterface = ({ syncTrigger, isConnected }) => {
   const [orders, setOrders] = useState([]);
   const [stats, setStats] = useState({});
   const [tables, setTables] = useState([]);
+  const syncCursor = useRef(0);
+  const syncQueue = useRef(Promise.resolve());
 
+  // Refresh on every WebSocket event (and on mount)
   useEffect(() => {
-    fetchOrders();
+    syncChanges();
     fetchStats();
-    fetchTables();
+  }, [syncTrigger]);
+
+  // Catch up after a reconnect; fall back to polling only while the WebSocket is down
+  useEffect(() => {
+    if (isConnected) {
+      syncChanges();
+      fetchStats();
+      return;
+    }
     const interval = setInterval(() => {
-      fetchOrders();
+      syncChanges();
       fetchStats();
-      fetchTables();
     }, 5000);
     return () => clearInterval(interval);
-  }, []);
+  }, [isConnected]);
 
-  const fetchOrders = async () => {
+  const applySync = async () => {
     try {
-      const response = await axios.get(`${API}/orders/active`);
-      setOrders(response.data);
+      const response = await axios.get(`${API}/sync`, { params: { since: syncCursor.current } });
+      const { cursor, full, orders: changedOrders, tables: changedTables } = response.data;
+      syncCursor.current = cursor;
+      setOrders(prev => mergeById(prev, changedOrders, full)
+        .filter(order => ACTIVE_STATUSES.includes(order.status))
+        .sort((a, b) => new Date(a.created_at) - new Date(b.created_at)));
+      setTables(prev => mergeById(prev, changedTables, full)
+        .sort((a, b) => a.number - b.number));
     } catch (error) {
-      console.error('Error fetching orders:', error);
+      console.error('Error syncing orders:', error);
     }
   };
 
+  // Serialize syncs so an older response never overwrites a newer one
+  const syncChanges = () => {
+    syncQueue.current = syncQueue.current.then(applySync);
+    return syncQueue.current;
+  };
+
   const fetchStats = async () => {
     try {
       const response = await axios.get(`${API}/dashboard/stats`);
@@ -341,20 +525,10 @@ const ManagerInterface = () => {
     }
   };
 
-  const fetchTables = async () => {
-    try {
-      const response = await axios.get(`${API}/tables`);
-      setTables(response.data);
-    } catch (error) {
-      console.error('Error fetching tables:', error);
-    }
-  };
-
   const updateOrderStatus = async (orderId, newStatus) => {
     try {
       await axios.put(`${API}/orders/${orderId}/status`, { status: newStatus });
-      fetchOrders();
-      fetchTables();
+      syncChanges();
     } catch (error) {
       console.error('Error updating order status:', error);
     }
@@ -519,7 +693,7 @@ const App = () => {
 
   // WebSocket message handler
   const handleWebSocketMessage = (data) => {
-    if (data.type === 'new_order' || data.type === 'order_status_update') {
+    if (['new_order', 'new_orders', 'order_status_update', 'order_cancelled', 'resync'].includes(data.type)) {
       setOrderUpdateTrigger(prev => prev + 1);
     }
   };
@@ -575,7 +749,7 @@ const App = () => {
       {view === 'waiter' ? (
         <WaiterInterface onOrderCreated={() => setOrderUpdateTrigger(prev => prev + 1)} />
       ) : (
-        <ManagerInterface key={orderUpdateTrigger} />
+        <ManagerInterface syncTrigger={orderUpdateTrigger} isConnected={isConnected} />
       )}
     </div>
   );
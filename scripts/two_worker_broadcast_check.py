@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Two-worker broadcast check
+Starts two uvicorn processes sharing the Mongo broadcast bus, connects a
+WebSocket to worker B, creates an order through worker A and verifies the
+new_order event arrives on worker B.
+
+Requires a local mongod reachable through MONGO_URL (backend/.env).
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import requests
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+PORTS = [8101, 8102]
+
+
+def start_worker(port: int) -> subprocess.Popen:
+    env = dict(os.environ, BROADCAST_BUS="mongo")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def wait_until_ready(port: int, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+
+async def check_cross_worker_delivery() -> bool:
+    api_a = f"http://127.0.0.1:{PORTS[0]}/api"
+    requests.post(f"{api_a}/init-data")
+    menu_item = requests.get(f"{api_a}/menu").json()[0]
+
+    async with websockets.connect(f"ws://127.0.0.1:{PORTS[1]}/ws") as ws:
+        # Give worker B's tail a moment to attach before publishing
+        await asyncio.sleep(1.0)
+        order = requests.post(f"{api_a}/orders", json={
+            "table_number": 1,
+            "waiter_name": "Two Worker Check",
+            "items": [{
+                "menu_item_id": menu_item["id"],
+                "menu_item_name": menu_item["name"],
+                "quantity": 1,
+                "price": menu_item["price"],
+            }],
+        }).json()
+
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            message = json.loads(await asyncio.wait_for(ws.recv(), timeout=deadline - time.time()))
+            if message.get("type") == "new_order" and message["order"]["id"] == order["id"]:
+                requests.delete(f"{api_a}/orders/{order['id']}")
+                return True
+    return False
+
+
+def main():
+    workers = [start_worker(port) for port in PORTS]
+    try:
+        for port in PORTS:
+            wait_until_ready(port)
+        delivered = asyncio.run(check_cross_worker_delivery())
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+    print("✅ PASS cross-worker broadcast" if delivered else "❌ FAIL cross-worker broadcast")
+    sys.exit(0 if delivered else 1)
+
+
+if __name__ == "__main__":
+    main()
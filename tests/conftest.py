@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+# server.py reads these at import; the Motor client connects lazily, so the
+# pure-logic tests never need a running mongod
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+class FakeWebSocket:
+    """Just enough of starlette's WebSocket for ConnectionManager."""
+
+    def __init__(self, host: str = "127.0.0.1"):
+        self.client = type("Address", (), {"host": host, "port": 50000})()
+        self.headers = {}
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+class StuckWebSocket(FakeWebSocket):
+    """A half-open client: sends never complete, so its queue only fills up."""
+
+    async def send_text(self, text: str):
+        await asyncio.Event().wait()
+
+    async def send_bytes(self, data: bytes):
+        await asyncio.Event().wait()
+
+
+@pytest.fixture
+def fake_websocket():
+    return FakeWebSocket
+
+
+@pytest.fixture
+def stuck_websocket():
+    return StuckWebSocket
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Points the server module at a fresh in-memory database."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.order_log, "database", database)
+    monkeypatch.setattr(server.order_log, "projection", server.OrderProjection())
+    monkeypatch.setattr(server, "table_occupancy", server.TableOccupancy())
+    # Module-wide state the write paths touch, so no counts or broadcasts leak between tests
+    monkeypatch.setattr(server, "dashboard_stats", server.DashboardStats())
+    monkeypatch.setattr(server, "manager", server.ConnectionManager())
+    monkeypatch.setattr(server, "menu_index", server.MenuPriceIndex())
+    return database
+
+
+def order_document(order_id: str = "o1", status: str = "pending", version: Optional[int] = 1) -> dict:
+    """An order as stored; version=None for one stored before orders carried a version."""
+    now = datetime.utcnow()
+    document = {
+        "id": order_id, "table_number": 3, "items": [], "status": status, "total_amount": 5.0,
+        "waiter_name": "Ana", "created_at": now, "updated_at": now,
+    }
+    if version is not None:
+        document["version"] = version
+    return document
+
+
+def order_status_event(order: dict):
+    import server
+
+    return server.Event({"type": "order_status_update", "order_id": order["id"], "status": order["status"]})
+
+
+@pytest.fixture
+def stored_order():
+    return order_document
+
+
+@pytest.fixture
+def status_event():
+    return order_status_event
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from server import (
+    WS_CLOSE_IDLE, WS_CLOSE_TRY_AGAIN_LATER, ClientConnection, ConnectionManager, Event, InMemoryBus, MongoBus,
+    compact_payload,
+)
+
+
+
+def frames(websocket):
+    return [json.loads(frame) for frame in websocket.sent]
+
+
+def test_in_memory_bus_delivers_once_to_other_managers(fake_websocket):
+    async def scenario():
+        bus = InMemoryBus()
+        origin, other = ConnectionManager(bus=bus), ConnectionManager(bus=bus)
+        await bus.start(origin)
+        await bus.start(other)
+        local, remote = fake_websocket(), fake_websocket()
+        await origin.connect(local)
+        await other.connect(remote)
+
+        await origin.broadcast(Event({"type": "new_order", "order_id": "o1"}, topics=["orders"]))
+        await asyncio.sleep(0.01)  # let the per-connection writers drain
+        return frames(local), frames(remote)
+
+    local, remote = asyncio.run(scenario())
+    assert [frame["type"] for frame in local] == ["hello", "new_order"]
+    assert [frame["type"] for frame in remote] == ["hello", "new_order"]
+    assert remote[1]["order_id"] == "o1"
+
+
+
+def bus_document(random_bytes: str, created_at: datetime, n: int) -> dict:
+    # Same second, so only the random part of the ObjectId orders them
+    object_id = ObjectId(bytes.fromhex(f"{int(time.time()):08x}" + random_bytes * 8))
+    event = Event({"type": "new_order", "n": n}, topics=["orders"])
+    return {"_id": object_id, "origin": "other-worker", "data": event.data, "topics": ["orders"], "created_at": created_at}
+
+
+def test_mongo_bus_tail_restarts_in_insertion_order(mongo, fake_websocket):
+    async def scenario():
+        manager = ConnectionManager()
+        bus = MongoBus(mongo)
+        websocket = fake_websocket()
+        await manager.connect(websocket)
+        now = datetime.utcnow()
+        await mongo.broadcast_events.insert_one(bus_document("aa", now - timedelta(minutes=1), 0))
+        await bus.start(manager)
+        await asyncio.sleep(0.1)  # the tail has started
+        await mongo.broadcast_events.insert_one(bus_document("ff", now, 1))
+        await asyncio.sleep(0.7)
+        # Inserted after n=1 but with a lower _id, picked up by a restarted cursor
+        await mongo.broadcast_events.insert_one(bus_document("00", now, 2))
+        await asyncio.sleep(1.2)
+        await bus.stop(manager)
+        return [frame["n"] for frame in frames(websocket) if frame["type"] == "new_order"]
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+def replay_manager():
+    # Five events through a three-event buffer: seqs 3, 4 and 5 remain
+    manager = ConnectionManager(replay_size=3)
+    for number in range(5):
+        manager.deliver(Event({"type": "new_order", "n": number}, topics=["orders", f"table:{number}"]))
+    return manager
+
+
+def replayed_seqs(manager, seq, connection):
+    missed = manager.replay_since(seq, connection)
+    return None if missed is None else [event.seq for event in missed]
+
+
+@pytest.mark.parametrize("seq, expected", [
+    (5, []),            # up to date
+    (6, None),          # ahead of this stream: the client saw another process
+    (2, [3, 4, 5]),     # oldest buffered event is the next one
+    (1, None),          # seq 2 was evicted
+    (4, [5]),
+])
+def test_replay_since_boundaries(fake_websocket, seq, expected):
+    connection = ClientConnection(fake_websocket(), 8)
+    connection.topics = {"*"}
+    assert replayed_seqs(replay_manager(), seq, connection) == expected
+
+
+def test_replay_since_only_returns_subscribed_events(fake_websocket):
+    connection = ClientConnection(fake_websocket(), 8)
+    connection.topics = {"table:3"}
+    assert replayed_seqs(replay_manager(), 2, connection) == [4]
+
+
+def test_replay_since_with_an_empty_buffer(fake_websocket):
+    connection = ClientConnection(fake_websocket(), 8)
+    assert ConnectionManager().replay_since(0, connection) == []
+
+
+def test_per_ip_cap_is_off_by_default(fake_websocket):
+    async def scenario():
+        manager = ConnectionManager(max_connections=100)
+        # e.g. every tablet behind the restaurant's NAT
+        return [await manager.connect(fake_websocket("10.0.0.1")) for _ in range(30)]
+
+    assert all(asyncio.run(scenario()))
+
+
+def test_per_ip_cap_when_set(fake_websocket):
+    async def scenario():
+        manager = ConnectionManager(max_connections=100, max_per_ip=2)
+        accepted = [await manager.connect(fake_websocket("10.0.0.1")) for _ in range(3)]
+        return accepted, await manager.connect(fake_websocket("10.0.0.2"))
+
+    accepted, other_ip = asyncio.run(scenario())
+    assert accepted == [True, True, False]
+    assert other_ip
+
+
+
+def test_coalesce_keeps_the_newest_frames_for_a_slow_client(fake_websocket, stuck_websocket):
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, policy="coalesce")
+        slow, fast = stuck_websocket(), fake_websocket()
+        await manager.connect(slow)
+        await manager.connect(fast)
+        await asyncio.sleep(0)  # the slow writer takes its hello and blocks on it
+        for number in range(4):
+            manager.deliver(Event({"type": "new_order", "n": number}))
+            await asyncio.sleep(0)  # the fast writer keeps up
+        await asyncio.sleep(0.01)
+        queued = [manager.active_connections[slow].queue.get_nowait().seq for _ in range(2)]
+        return manager, slow, fast, queued
+
+    manager, slow, fast, queued = asyncio.run(scenario())
+    assert queued == [3, 4]
+    assert manager.dropped_messages == 2 and manager.evicted_connections == 0
+    assert manager.active_connections[slow].dropped == 2
+    assert [frame.get("n") for frame in frames(fast)] == [None, 0, 1, 2, 3]
+
+
+def test_drop_disconnects_a_slow_client(fake_websocket, stuck_websocket):
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, policy="drop")
+        slow, fast = stuck_websocket(), fake_websocket()
+        await manager.connect(slow)
+        await manager.connect(fast)
+        await asyncio.sleep(0)
+        for number in range(4):
+            manager.deliver(Event({"type": "new_order", "n": number}))
+            await asyncio.sleep(0)  # the fast writer keeps up
+        await asyncio.sleep(0.01)
+        return manager, slow, fast
+
+    manager, slow, fast = asyncio.run(scenario())
+    assert slow not in manager.active_connections and slow.closed_with == WS_CLOSE_TRY_AGAIN_LATER
+    # Evicted on the third event; it receives nothing after that
+    assert manager.dropped_messages == 1 and manager.evicted_connections == 1
+    assert manager.stats()["connections"] == 1
+    assert [frame.get("n") for frame in frames(fast)] == [None, 0, 1, 2, 3]
+
+def test_reap_evicts_full_queues_under_the_drop_policy(fake_websocket, stuck_websocket):
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, policy="drop", idle_timeout=60)
+        stuck = [stuck_websocket() for _ in range(3)]
+        for websocket in stuck:
+            await manager.connect(websocket)
+        idle = fake_websocket()
+        await manager.connect(idle)
+        await asyncio.sleep(0)  # writers take the hello frames and block on them
+        manager.reap()
+        manager.reap()  # the stuck queues are now full
+        manager.active_connections[idle].last_seen -= 120
+        reaped = manager.reap()
+        await asyncio.sleep(0)
+        return manager, stuck, idle, reaped
+
+    manager, stuck, idle, reaped = asyncio.run(scenario())
+    assert reaped == 1 and manager.reaped_connections == 1
+    assert manager.evicted_connections == 3
+    assert manager.active_connections == {}
+    assert [websocket.closed_with for websocket in stuck] == [WS_CLOSE_TRY_AGAIN_LATER] * 3
+    assert idle.closed_with == WS_CLOSE_IDLE
+
+
+@pytest.mark.parametrize("payload", [{}, {"type": "new_order", "order_id": "o1"}])
+def test_with_seq_splices_seq_into_the_encoded_bytes(payload):
+    event = Event(payload, topics=["orders"])
+    sequenced = event.with_seq(7)
+    assert json.loads(sequenced.data) == {"seq": 7, **payload}
+    assert sequenced.seq == 7 and sequenced.topics == event.topics
+    assert json.loads(event.data) == payload
+
+
+ORDER_PAYLOAD = {
+    "type": "new_order",
+    "order": {
+        "id": "o1", "table_number": 3, "waiter_name": "Ana", "status": "pending",
+        "special_requests": None, "total_amount": 16.5,
+        "created_at": datetime(2024, 5, 1, 12, 0, 0, 250000),
+        "items": [
+            {"menu_item_id": "latte", "menu_item_name": "Latte", "quantity": 2, "price": 5.5, "special_requests": None},
+            {"menu_item_id": "toast", "menu_item_name": "Toast", "quantity": 1, "price": 5.5, "special_requests": "no butter"},
+        ],
+    },
+    "timestamp": datetime(2024, 5, 1, 12, 0, 1),
+}
+COMPACT_ORDER = {
+    "t": "new_order",
+    "o": {
+        "i": "o1", "n": 3, "w": "Ana", "st": "pending", "a": 16.5, "c": 1714564800250,
+        "it": [["latte", 2], ["toast", 1, "no butter"]],
+    },
+    "ts": 1714564801000,
+}
+
+
+def test_compact_payload_shortens_keys_times_and_items():
+    assert compact_payload(ORDER_PAYLOAD) == COMPACT_ORDER
+
+
+@pytest.mark.parametrize("encoding", ["compact", "msgpack"])
+def test_encoded_round_trip(encoding):
+    decode = json.loads if encoding == "compact" else pytest.importorskip("msgpack").unpackb
+    event = Event(ORDER_PAYLOAD, topics=["orders"]).with_seq(4)
+    assert decode(event.encoded(encoding)) == {"s": 4, **COMPACT_ORDER}
+    # Encoded once and shared by every socket on that format
+    assert event.encoded(encoding) is event.encoded(encoding)
+
+
+def test_compact_clients_get_binary_frames(fake_websocket):
+    async def scenario():
+        manager = ConnectionManager()
+        compact, plain = fake_websocket(), fake_websocket()
+        await manager.connect(compact, encoding="compact")
+        await manager.connect(plain)
+        manager.deliver(Event(ORDER_PAYLOAD, topics=["orders"]))
+        await asyncio.sleep(0.01)
+        return compact.sent, plain.sent
+
+    compact, plain = asyncio.run(scenario())
+    assert all(isinstance(frame, bytes) for frame in compact)
+    assert json.loads(compact[-1]) == {"s": 1, **COMPACT_ORDER}
+    assert json.loads(plain[-1])["order"]["items"][0]["menu_item_name"] == "Latte"
@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+import server
+from server import DashboardStats, OrderStatus, TableStatus
+
+
+def stats_for_today() -> DashboardStats:
+    stats = DashboardStats()
+    stats.table_added({"id": "t1", "number": 1, "status": "available"})
+    stats.table_added({"id": "t2", "number": 2, "status": "available"})
+    stats.revenue_day = server.today_start_utc()
+    return stats
+
+
+def order(status: str, total: float = 12.5, created_at: Optional[datetime] = None) -> dict:
+    return {"status": status, "total_amount": total, "created_at": created_at or datetime.utcnow()}
+
+
+def test_counters_follow_status_changes():
+    stats = stats_for_today()
+    stats.order_created(order("pending"))
+    stats.order_created(order("pending"))
+    stats.order_status_changed(order("pending"), OrderStatus.PREPARING)
+    stats.order_status_changed(order("preparing"), OrderStatus.PREPARING)  # no-op
+    stats.order_status_changed(order("preparing"), OrderStatus.READY)
+    assert stats.snapshot()["orders"] == {"pending": 1, "ready": 1}
+
+
+def test_today_revenue_counts_delivered_orders_created_today():
+    stats = stats_for_today()
+    stats.order_status_changed(order("ready", 20.0), OrderStatus.DELIVERED)
+    stats.order_status_changed(order("ready", 7.5, created_at=stats.revenue_day - timedelta(minutes=5)),
+                               OrderStatus.DELIVERED)
+    assert stats.snapshot()["today_revenue"] == 20.0
+    # Moving a delivered order back takes its revenue out again
+    stats.order_status_changed(order("delivered", 20.0), OrderStatus.CANCELLED)
+    assert stats.snapshot()["today_revenue"] == 0.0
+
+
+def test_revenue_resets_when_the_day_rolls(monkeypatch):
+    stats = stats_for_today()
+    stats.order_status_changed(order("ready", 20.0), OrderStatus.DELIVERED)
+    tomorrow = stats.revenue_day + timedelta(days=1)
+    monkeypatch.setattr(server, "today_start_utc", lambda: tomorrow)
+    assert stats.snapshot()["today_revenue"] == 0.0
+    assert stats.revenue_day == tomorrow
+
+
+def test_table_counts_by_number_or_id():
+    stats = stats_for_today()
+    stats.table_status_changed(TableStatus.OCCUPIED, number=2)
+    stats.table_status_changed(TableStatus.RESERVED, table_id="t1")
+    stats.table_status_changed(TableStatus.OCCUPIED, number=9)  # unknown table, ignored
+    assert stats.snapshot()["tables"] == {"occupied": 1, "reserved": 1}
+
+
+def test_load_seeds_from_the_database(mongo):
+    now = datetime.utcnow()
+
+    async def scenario():
+        await mongo.tables.insert_many([
+            {"id": "t1", "number": 1, "status": "occupied"}, {"id": "t2", "number": 2, "status": "available"},
+        ])
+        await mongo.orders.insert_many([
+            {"id": "a", "status": "delivered", "total_amount": 10.0, "created_at": now},
+            {"id": "b", "status": "delivered", "total_amount": 4.0, "created_at": now - timedelta(days=2)},
+            {"id": "c", "status": "pending", "total_amount": 3.0, "created_at": now},
+        ])
+        stats = DashboardStats()
+        await stats.load(mongo)
+        stats.table_status_changed(TableStatus.AVAILABLE, number=1)
+        return stats.snapshot()
+
+    assert asyncio.run(scenario()) == {
+        "orders": {"delivered": 2, "pending": 1},
+        "tables": {"available": 2},
+        "today_revenue": 10.0,
+    }
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_failed_index_does_not_block_the_others(mongo):
+    async def scenario():
+        await mongo.tables.insert_many([
+            {"id": "a", "number": 1, "capacity": 4, "status": "available"},
+            {"id": "b", "number": 1, "capacity": 2, "status": "available"},
+        ])
+        await server.ensure_indexes(mongo)
+        names = set((await mongo.tables.index_information()).keys())
+        with pytest.raises(HTTPException) as rejected:
+            await server.create_table(server.TableCreate(number=1, capacity=4))
+        return names, rejected.value
+
+    names, rejected = asyncio.run(scenario())
+    assert {"id_unique", "sync_seq"} <= names
+    assert "number_unique" not in names
+    assert ("tables", "number_unique") in server.missing_indexes
+    assert rejected.status_code == 400
@@ -0,0 +1,7 @@
+from server import CachedBody
+
+
+def test_etag_depends_on_the_body_only():
+    # Workers bump their cache version independently
+    assert CachedBody(b'[{"name": "Latte"}]', 1).etag == CachedBody(b'[{"name": "Latte"}]', 7).etag
+    assert CachedBody(b'[{"name": "Latte"}]', 1).etag != CachedBody(b'[{"name": "Mocha"}]', 1).etag
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from server import app, decode_order_cursor, encode_order_cursor
+
+
+def test_cursor_round_trip_selects_strictly_older_orders():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    cursor = encode_order_cursor({"created_at": created_at, "id": "order|with|pipes"})
+    assert decode_order_cursor(cursor) == {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": "order|with|pipes"}},
+    ]}
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm8tc2VwYXJhdG9y", "YmFkLWRhdGV8aWQ="])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as rejected:
+        decode_order_cursor(cursor)
+    assert rejected.value.status_code == 400
+
+
+def test_cross_origin_clients_can_read_the_cursor_header():
+    # Not entered as a context manager, so the lifespan never touches Mongo
+    response = TestClient(app).get("/", headers={"Origin": "http://tablet.local:3000"})
+    exposed = {header.strip() for header in response.headers["access-control-expose-headers"].split(",")}
+    assert {"X-Next-Cursor", "X-Menu-Version"} <= exposed
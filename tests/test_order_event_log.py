@@ -0,0 +1,19 @@
+import asyncio
+
+import server
+from server import OrderStatus, transition_order
+
+
+def test_first_change_of_a_legacy_order_reaches_the_projection(mongo, stored_order, status_event):
+    async def scenario():
+        # Stored before orders carried a version
+        await mongo.orders.insert_many([stored_order("moved", version=None), stored_order("cancelled", version=None)])
+        await server.order_log.load()
+        await transition_order("moved", OrderStatus.PREPARING, status_event)
+        await transition_order("cancelled", OrderStatus.CANCELLED, status_event)
+        return server.order_log.projection
+
+    projection = asyncio.run(scenario())
+    assert projection.board.get("moved")["status"] == OrderStatus.PREPARING
+    assert projection.board.get("cancelled") is None
+    assert projection.tables[3] == {"moved"}
@@ -0,0 +1,152 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import server
+from server import Order, OrderBatch, OrderIntake, OrderItem
+
+
+def new_order(table_number: int = 4) -> Order:
+    return Order(
+        table_number=table_number, waiter_name="Ana", total_amount=5.0,
+        items=[OrderItem(menu_item_id="latte", menu_item_name="Latte", quantity=1, price=5.0)],
+    )
+
+
+async def flushed(intake: OrderIntake):
+    while intake.unflushed:
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def tables(mongo):
+    async def seed():
+        await mongo.tables.insert_many([
+            {"id": f"t{number}", "number": number, "capacity": 4, "status": "available"} for number in range(1, 6)
+        ])
+        await server.table_occupancy.load(mongo, server.order_log.projection)
+    asyncio.run(seed())
+    return mongo
+
+
+def test_order_stored_before_a_crash_still_gets_its_side_effects(tables, tmp_path):
+    order = new_order()
+    journal = tmp_path / "orders.journal"
+    # Crashed after insert_many, before the flushed marker and record_new_orders
+    journal.write_bytes(OrderIntake._order_line(order, None))
+
+    async def scenario():
+        await tables.orders.insert_one({**order.dict(), "version": 1})
+        intake = OrderIntake(path=journal, fsync=False)
+        await intake.start()
+        await flushed(intake)
+        await intake.stop()
+        table = await tables.tables.find_one({"number": 4})
+        events = await tables.order_events.count_documents({"order_id": order.id, "type": "created"})
+        return intake, table, events
+
+    intake, table, events = asyncio.run(scenario())
+    assert intake.recovered == 1
+    assert server.order_log.projection.board.get(order.id) is not None
+    assert table["status"] == "occupied"
+    assert events == 1
+
+
+def test_a_journal_has_a_single_owner(tmp_path):
+    async def scenario():
+        owner = OrderIntake(path=tmp_path / "orders.journal", fsync=False)
+        await owner.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await OrderIntake(path=tmp_path / "orders.journal", fsync=False).start()
+        finally:
+            await owner.stop()
+
+    asyncio.run(scenario())
+
+
+def test_batch_submissions_go_through_the_journal(tables, tmp_path, monkeypatch):
+    intake = OrderIntake(path=tmp_path / "orders.journal", fsync=False)
+    monkeypatch.setattr(server, "order_intake", intake)
+    batch = OrderBatch(orders=[{
+        "table_number": 2, "waiter_name": "Ana", "idempotency_key": "device-1",
+        "items": [{"menu_item_id": "latte", "quantity": 2}],
+    }])
+
+    async def scenario():
+        await tables.menu_items.insert_one({
+            "id": "latte", "name": "Latte", "description": "", "price": 5.5, "category": "Bebidas",
+            "available": True, "created_at": datetime.utcnow(),
+        })
+        await intake.start()
+        first = await server.create_orders_batch(batch)
+        # Replayed while the first one is still journaled
+        replay = await server.create_orders_batch(batch)
+        await flushed(intake)
+        stored = await tables.orders.find({"idempotency_key": "device-1"}, {"_id": 0}).to_list(None)
+        await intake.stop()
+        return first, replay, stored
+
+    first, replay, stored = asyncio.run(scenario())
+    assert first.created == 1 and replay.replayed == 1
+    assert replay.orders[0].id == first.orders[0].id
+    assert [order["id"] for order in stored] == [first.orders[0].id]
+    assert stored[0]["total_amount"] == 11.0
+
+
+def test_a_failed_compaction_keeps_the_journal_open(tables, tmp_path):
+    intake = OrderIntake(path=tmp_path / "orders.journal", fsync=False, max_bytes=1)
+
+    def out_of_space(orders):
+        raise OSError(28, "No space left on device")
+
+    async def scenario():
+        await intake.start()
+        intake._rewrite = out_of_space
+        first, second = new_order(), new_order(table_number=5)
+        await asyncio.wait_for(intake.submit([first]), 2)
+        await asyncio.wait_for(intake.submit([second]), 2)
+        await flushed(intake)
+        await intake.stop()
+        return [order.id for order, _ in intake._read_journal()], first, second
+
+    unflushed, first, second = asyncio.run(scenario())
+    # Both went into the journal that was never swapped, and both got their marker
+    assert unflushed == []
+    assert intake.accepted == 2 and intake.flushed == 2
+
+
+def test_a_failed_flushed_marker_does_not_stop_the_flusher(tables, tmp_path):
+    intake = OrderIntake(path=tmp_path / "orders.journal", fsync=False)
+
+    async def scenario():
+        await intake.start()
+        write = intake._write
+
+        def no_markers(data: bytes):
+            if b'"flushed"' in data:
+                raise OSError(5, "Input/output error")
+            write(data)
+
+        intake._write = no_markers
+        for table_number in (4, 5):
+            await asyncio.wait_for(intake.submit([new_order(table_number)]), 2)
+            await asyncio.wait_for(flushed(intake), 2)
+        await intake.stop()
+        return await tables.orders.count_documents({})
+
+    assert asyncio.run(scenario()) == 2
+    assert intake.flushed == 2
+
+
+def test_a_transition_on_a_stuck_order_answers_503(tables, tmp_path, monkeypatch):
+    intake = OrderIntake(path=tmp_path / "orders.journal", fsync=False, flush_wait=0.05)
+    monkeypatch.setattr(server, "order_intake", intake)
+    order = new_order()
+    # Journaled, but the flusher never gets to it
+    intake._register(order, None)
+
+    with pytest.raises(server.HTTPException) as raised:
+        asyncio.run(server.transition_order(order.id, server.OrderStatus.PREPARING, lambda after: None))
+    assert raised.value.status_code == 503
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import MenuPriceEntry, MenuPriceIndex, OrderBatch, OrderCreate, OrderItemCreate
+
+
+def menu() -> MenuPriceIndex:
+    index = MenuPriceIndex()
+    index.items = {
+        "latte": MenuPriceEntry("Latte", 5.5, True),
+        "toast": MenuPriceEntry("Toast", 4.0, True),
+        "soup": MenuPriceEntry("Sopa do dia", 9.0, False),
+    }
+    return index
+
+
+def test_client_names_and_prices_are_ignored():
+    priced = menu().price_items([
+        OrderItemCreate(menu_item_id="latte", quantity=2, menu_item_name="Free latte", price=0.01),
+        OrderItemCreate(menu_item_id="toast", quantity=1, special_requests="no butter"),
+    ])
+    assert [(item.menu_item_name, item.price, item.quantity) for item in priced] == [
+        ("Latte", 5.5, 2), ("Toast", 4.0, 1),
+    ]
+    assert priced[1].special_requests == "no butter"
+
+
+@pytest.mark.parametrize("item, error", [
+    (OrderItemCreate(menu_item_id="ghost", quantity=1), "Unknown menu item: ghost"),
+    (OrderItemCreate(menu_item_id="soup", quantity=1), "Menu item not available: Sopa do dia"),
+    (OrderItemCreate(menu_item_id="latte", quantity=0), "Invalid quantity for Latte: 0"),
+    (OrderItemCreate(menu_item_id="latte", quantity=-3), "Invalid quantity for Latte: -3"),
+])
+def test_bad_items_are_a_422(item, error):
+    with pytest.raises(HTTPException) as rejected:
+        menu().price_items([OrderItemCreate(menu_item_id="toast", quantity=1), item])
+    assert rejected.value.status_code == 422
+    assert rejected.value.detail == [error]
+
+
+def test_build_order_totals_the_menu_prices(monkeypatch):
+    monkeypatch.setattr(server, "menu_index", menu())
+    order = server.build_order(OrderCreate(table_number=2, waiter_name="Ana", items=[
+        {"menu_item_id": "latte", "quantity": 2, "price": 0.01},
+        {"menu_item_id": "toast", "quantity": 1},
+    ]))
+    assert order.total_amount == 15.0
+    assert order.status == "pending"
+
+
+def test_batch_rejects_only_the_bad_order(mongo):
+    batch = OrderBatch(orders=[
+        {"table_number": 1, "waiter_name": "Ana", "idempotency_key": "good",
+         "items": [{"menu_item_id": "latte", "quantity": 1, "price": 0.01}]},
+        {"table_number": 2, "waiter_name": "Ana", "idempotency_key": "bad",
+         "items": [{"menu_item_id": "latte", "quantity": 1}, {"menu_item_id": "soup", "quantity": 1}]},
+    ])
+
+    async def scenario():
+        await mongo.menu_items.insert_many([
+            {"id": "latte", "name": "Latte", "description": "", "price": 5.5, "category": "Bebidas",
+             "available": True, "created_at": datetime.utcnow()},
+            {"id": "soup", "name": "Sopa do dia", "description": "", "price": 9.0, "category": "Pratos",
+             "available": False, "created_at": datetime.utcnow()},
+        ])
+        result = await server.create_orders_batch(batch)
+        return result, await mongo.orders.find({}, {"_id": 0}).to_list(None)
+
+    result, stored = asyncio.run(scenario())
+    assert result.created == 1 and [order.id for order in result.orders] == [stored[0]["id"]]
+    assert [(rejection.idempotency_key, rejection.errors) for rejection in result.rejected] == [
+        ("bad", ["Menu item not available: Sopa do dia"]),
+    ]
+    assert stored[0]["idempotency_key"] == "good" and stored[0]["total_amount"] == 5.5
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from server import OrderStatus, transition_order
+
+
+@pytest.fixture
+def attempt(mongo, stored_order, status_event):
+    def run(status: str, target: OrderStatus):
+        async def scenario():
+            await mongo.orders.insert_one(stored_order(status=status))
+            return await transition_order("o1", target, status_event)
+
+        return asyncio.run(scenario())
+    return run
+
+
+def test_allowed_transition_returns_the_post_image(attempt):
+    after = attempt("pending", OrderStatus.PREPARING)
+    assert after["status"] == OrderStatus.PREPARING
+    assert after["version"] == 2
+
+
+@pytest.mark.parametrize("status, target", [
+    ("pending", OrderStatus.DELIVERED),
+    ("delivered", OrderStatus.CANCELLED),
+    ("cancelled", OrderStatus.PREPARING),
+])
+def test_disallowed_transition_is_a_409(attempt, status, target):
+    with pytest.raises(HTTPException) as rejected:
+        attempt(status, target)
+    assert rejected.value.status_code == 409
+    assert f"from {status} to {target.value}" in rejected.value.detail
+
+
+def test_unknown_order_is_a_404(mongo, status_event):
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(transition_order("missing", OrderStatus.PREPARING, status_event))
+    assert rejected.value.status_code == 404
@@ -0,0 +1,32 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from server import (
+    HTTP_REQUEST_MONGO_COMMANDS, HTTP_REQUEST_SECONDS, RequestMetricsMiddleware, current_request_metrics,
+)
+
+
+def test_streamed_response_is_observed_after_its_last_chunk():
+    app = FastAPI()
+    app.add_middleware(RequestMetricsMiddleware)
+
+    @app.get("/stream-under-test")
+    async def stream():
+        async def chunks():
+            for _ in range(3):
+                # Stands in for a getMore issued while the body is streaming
+                current_request_metrics.get().commands.append(("getMore", "orders", 0.001, True))
+                await asyncio.sleep(0.05)
+                yield b"{}\n"
+        return StreamingResponse(chunks())
+
+    commands = HTTP_REQUEST_MONGO_COMMANDS.labels("GET", "/stream-under-test")
+    seconds = HTTP_REQUEST_SECONDS.labels("GET", "/stream-under-test", "200")
+    with TestClient(app) as client:
+        assert client.get("/stream-under-test").content == b"{}\n" * 3
+
+    assert commands._sum.get() == 3
+    assert seconds._sum.get() >= 0.15
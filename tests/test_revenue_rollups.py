@@ -0,0 +1,30 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from server import bucket_start
+
+NEW_YORK = ZoneInfo("America/New_York")
+SAO_PAULO = ZoneInfo("America/Sao_Paulo")
+
+
+@pytest.mark.parametrize("moment, zone, granularity, start", [
+    # Spring forward (02:00 -> 03:00): the day still starts at midnight EST
+    (datetime(2024, 3, 10, 15, 0), NEW_YORK, "day", datetime(2024, 3, 10, 5, 0)),
+    (datetime(2024, 3, 10, 7, 30), NEW_YORK, "hour", datetime(2024, 3, 10, 7, 0)),
+    # Fall back: midnight is EDT, and 01:30 happens twice, in different hours
+    (datetime(2024, 11, 3, 12, 0), NEW_YORK, "day", datetime(2024, 11, 3, 4, 0)),
+    (datetime(2024, 11, 3, 5, 30), NEW_YORK, "hour", datetime(2024, 11, 3, 5, 0)),
+    (datetime(2024, 11, 3, 6, 30), NEW_YORK, "hour", datetime(2024, 11, 3, 6, 0)),
+    # Brazil moved clocks forward at midnight in 2018, so 00:00 never happened
+    (datetime(2018, 11, 4, 15, 0), SAO_PAULO, "day", datetime(2018, 11, 4, 3, 0)),
+])
+def test_bucket_start_on_dst_days(moment, zone, granularity, start):
+    assert bucket_start(moment, zone, granularity) == start
+
+
+def test_fall_back_day_is_25_hours_long():
+    today = bucket_start(datetime(2024, 11, 3, 12, 0), NEW_YORK, "day")
+    tomorrow = bucket_start(datetime(2024, 11, 4, 12, 0), NEW_YORK, "day")
+    assert (tomorrow - today).total_seconds() == 25 * 3600
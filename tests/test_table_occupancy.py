@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import server
+from server import TableOccupancy, TableStatus, order_event
+
+
+def event(order_id: str, status: str, table_number: int = 3, event_type: str = "status_changed") -> dict:
+    now = datetime.utcnow()
+    return order_event(event_type, {
+        "id": order_id, "table_number": table_number, "status": status, "version": 1,
+        "created_at": now, "updated_at": now,
+    })
+
+
+class FlakyCollection:
+    """Fails the first call to `method`, like a primary stepping down."""
+
+    def __init__(self, collection, method: str):
+        self.collection = collection
+        self.method = method
+        self.failures = 1
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if name != self.method:
+            return attribute
+
+        async def flaky(*args, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("not primary")
+            return await attribute(*args, **kwargs)
+        return flaky
+
+
+class FlakyDatabase:
+    def __init__(self, database, **collections):
+        self.database = database
+        self.collections = collections
+
+    def __getattr__(self, name):
+        return self.collections.get(name) or getattr(self.database, name)
+
+    def __getitem__(self, name):
+        return self.collections.get(name) or self.database[name]
+
+
+def test_status_is_written_only_when_the_table_flips(mongo):
+    occupancy = TableOccupancy()
+
+    async def scenario():
+        await mongo.tables.insert_one({"id": "t3", "number": 3, "capacity": 4, "status": "available"})
+        await occupancy.load(mongo, server.OrderProjection())
+        await occupancy.record(mongo, [event("a", "pending", event_type="created")])
+        await occupancy.record(mongo, [event("b", "pending", event_type="created")])
+        await occupancy.record(mongo, [event("a", "delivered")])
+        occupied = (await mongo.tables.find_one({"number": 3}))["status"]
+        await occupancy.record(mongo, [event("b", "cancelled")])
+        return occupied, (await mongo.tables.find_one({"number": 3}))["status"]
+
+    occupied, freed = asyncio.run(scenario())
+    assert (occupied, freed) == (TableStatus.OCCUPIED, TableStatus.AVAILABLE)
+    assert occupancy.writes == 2 and occupancy.skipped == 2
+    session = asyncio.run(mongo.table_sessions.find_one({}, {"_id": 0}))
+    assert session["table_number"] == 3 and session["orders"] == 2
+
+
+def test_a_failed_flip_write_is_retried(mongo):
+    occupancy = TableOccupancy()
+
+    async def scenario():
+        await mongo.tables.insert_one({"id": "t3", "number": 3, "capacity": 4, "status": "available"})
+        await occupancy.load(mongo, server.OrderProjection())
+        flaky = FlakyDatabase(mongo, tables=FlakyCollection(mongo.tables, "bulk_write"))
+        # Logged, not raised: the order behind the event is already stored
+        await occupancy.record(flaky, [event("a", "pending", event_type="created")])
+        failed = (await mongo.tables.find_one({"number": 3}))["status"]
+        # A later event on the table does not flip it, but still carries the write
+        await occupancy.record(flaky, [event("a", "preparing")])
+        return failed, (await mongo.tables.find_one({"number": 3}))["status"]
+
+    assert asyncio.run(scenario()) == (TableStatus.AVAILABLE, TableStatus.OCCUPIED)
+
+
+def test_a_failed_session_insert_is_retried(mongo):
+    occupancy = TableOccupancy()
+
+    async def scenario():
+        await mongo.tables.insert_many([
+            {"id": f"t{number}", "number": number, "capacity": 4, "status": "available"} for number in (3, 4)
+        ])
+        await occupancy.load(mongo, server.OrderProjection())
+        flaky = FlakyDatabase(mongo, table_sessions=FlakyCollection(mongo.table_sessions, "insert_many"))
+        await occupancy.record(flaky, [event("a", "pending", event_type="created")])
+        await occupancy.record(flaky, [event("a", "delivered")])
+        await occupancy.record(flaky, [event("b", "pending", table_number=4, event_type="created")])
+        await occupancy.record(flaky, [event("b", "delivered", table_number=4)])
+        return await mongo.table_sessions.find({}, {"_id": 0}).to_list(None)
+
+    assert sorted(session["table_number"] for session in asyncio.run(scenario())) == [3, 4]
+
+
+def test_a_failed_table_write_does_not_fail_the_order(mongo, monkeypatch):
+    monkeypatch.setattr(server, "db", FlakyDatabase(mongo, tables=FlakyCollection(mongo.tables, "bulk_write")))
+
+    async def scenario():
+        await mongo.menu_items.insert_one({
+            "id": "latte", "name": "Latte", "description": "", "price": 5.5, "category": "Bebidas",
+            "available": True, "created_at": datetime.utcnow(),
+        })
+        await mongo.tables.insert_one({"id": "t3", "number": 3, "capacity": 4, "status": "available"})
+        await server.table_occupancy.load(mongo, server.OrderProjection())
+        return await server.create_order(server.OrderCreate(
+            table_number=3, waiter_name="Ana", items=[{"menu_item_id": "latte", "quantity": 1}],
+        ))
+
+    order = asyncio.run(scenario())
+    assert asyncio.run(mongo.orders.count_documents({"id": order.id})) == 1
+    assert server.manager.seq == 1
+
+
+def test_occupancy_endpoint_lists_every_table(mongo):
+    occupancy = server.table_occupancy
+
+    async def scenario():
+        await mongo.tables.insert_many([
+            {"id": f"t{number}", "number": number, "capacity": 4, "status": "available"} for number in (1, 2)
+        ])
+        await occupancy.load(mongo, server.OrderProjection())
+        await occupancy.record(mongo, [event("a", "pending", table_number=2, event_type="created")])
+        return await server.get_table_occupancy()
+
+    body = server.json.loads(asyncio.run(scenario()).body)
+    assert [table["table_number"] for table in body["tables"]] == [1, 2]
+    assert body["tables"][1]["open_orders"] == 1 and body["tables"][1]["occupied_since"]
+    assert body["table_count"] == 2 and body["occupied"] == 1